@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Measure the throughput of the main stages on a synthetic corpus.
+
+A queue and a disk image are generated (see corpus.py) in a temporary
+directory, then each stage is run several times and its best run is reported.
+
+Usage:
+  bench.py [options]
+
+Options:
+  --jobs=N                            Jobs of the parsed queue. [default: 1000]
+  --size=VALUE                        Disk image size in MB. [default: 64]
+  --density=VALUE                     Queues per MB of image. [default: 1]
+  --version=N                         BITS version. [default: 3]
+  --radiance=VALUE                    Radiance in kB. [default: 64]
+  --repeat=N                          Runs per stage. [default: 3]
+  --seed=N                            Random seed. [default: 0]
+  --help, -h                          Show this screen.
+"""
+import random
+import sys
+import tempfile
+import time
+
+from docopt import docopt
+from itertools import chain
+from pathlib import Path
+
+# benchmark the package of the repository, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bits
+
+from bits.const import MARKERS
+from bits.structs import QUEUE
+from corpus import sample_queue, sample_image
+
+
+def best(func, repeat):
+    """Return the shortest duration of `repeat` calls and the last result."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rv = func()
+        durations.append(time.perf_counter() - start)
+
+    return min(durations), rv
+
+
+def report(name, duration, size, jobs=None):
+    print('%-14s %10.2f MB/s %12s' % (
+        name, size / duration / 2 ** 20,
+        '-' if jobs is None else '%.0f jobs/s' % (jobs / duration)))
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__)
+    rng = random.Random(int(args['--seed']))
+    version = int(args['--version'])
+    radiance = int(args['--radiance'])
+    repeat = int(args['--repeat'])
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+
+        queue = sample_queue(rng, version, int(args['--jobs']))
+        queue_fp = tmp_dir / 'qmgr0.dat'
+        queue_fp.write_bytes(queue)
+
+        image, _ = sample_image(rng, float(args['--size']),
+                                float(args['--density']), version=version)
+        image_fp = tmp_dir / 'image.bin'
+        image_fp.write_bytes(image)
+        del image
+
+        print('%-14s %15s %12s' % ('stage', 'throughput', 'jobs'))
+
+        duration, content = best(lambda: QUEUE.parse(queue), repeat)
+        report('QUEUE.parse', duration, len(queue), content.job_count)
+
+        def parse():
+            return list(bits.Bits.load_file(queue_fp).parse())
+
+        duration, parsed = best(parse, repeat)
+        report('Bits.parse', duration, len(queue), len(parsed))
+
+        duration, samples = best(lambda: list(bits.sample_disk(
+            image_fp, MARKERS, radiance, offsets=True)), repeat)
+        report('sample_disk', duration, image_fp.stat().st_size)
+
+        analyzer = bits.Bits()
+        for offset, sample in samples:
+            analyzer.append_data(sample, offset=offset)
+        analyzer.guess_info()
+
+        duration, carved = best(lambda: list(analyzer.carve()), repeat)
+        report('Bits.carve', duration, len(analyzer.raw_data), len(carved))
+
+        csv_fp = tmp_dir / 'jobs.csv'
+        jobs = list(chain(parsed, carved))
+        duration, _ = best(lambda: bits.write_csv(csv_fp, jobs), repeat)
+        report('write_csv', duration, csv_fp.stat().st_size, len(jobs))
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Compare interpreted and compiled parsing speed of the BITS structs.
+
+Usage:
+  bench_structs.py [--number=N]
+
+Options:
+  --number=N                          Parses per struct. [default: 2000]
+  --help, -h                          Show this screen.
+"""
+import sys
+import timeit
+
+from docopt import docopt
+from pathlib import Path
+
+# benchmark the package of the repository, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bits.structs import QUEUE, JOB, FILE, METADATA
+from corpus import sample_file, sample_job, sample_metadata, sample_queue
+
+
+def bench(name, compiled, data, number):
+    interpreted = compiled.subcon
+
+    # results only differ by their parsing streams
+    expected, result = interpreted.parse(data), compiled.parse(data)
+    del expected['_io'], result['_io']
+    assert expected == result
+
+    t_interpreted = timeit.timeit(lambda: interpreted.parse(data),
+                                  number=number)
+    t_compiled = timeit.timeit(lambda: compiled.parse(data), number=number)
+
+    print('%-10s %10.0f/s %10.0f/s %7.2fx' % (
+        name, number / t_interpreted, number / t_compiled,
+        t_interpreted / t_compiled))
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__)
+    number = int(args['--number'])
+
+    print('%-10s %12s %12s %8s' % ('struct', 'interpreted', 'compiled',
+                                   'speedup'))
+    bench('QUEUE', QUEUE, sample_queue(), number)
+    bench('JOB', JOB, sample_job(), number)
+    bench('FILE', FILE, sample_file(), number)
+    bench('METADATA', METADATA, sample_metadata(), number)
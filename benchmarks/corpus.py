@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic QMGR queues and disk images.
+
+Queues follow the layouts of `bits/structs.py`, with the job delimiter of the
+requested BITS version. Disk images mix random noise and zeroed areas with
+queues, some of them truncated or partially overwritten.
+
+Usage:
+  corpus.py queue [options] OUTPUT
+  corpus.py image [options] OUTPUT
+
+Options:
+  --version=N                         BITS version (job delimiter). [default: 3]
+  --jobs=N                            Jobs per queue. [default: 10]
+  --size=VALUE                        Image size in MB. [default: 64]
+  --density=VALUE                     Queues per MB of image. [default: 1]
+  --damage=RATIO                      Ratio of damaged queues. [default: 0.5]
+  --seed=N                            Random seed. [default: 0]
+  --help, -h                          Show this screen.
+"""
+import random
+import struct
+import sys
+
+from docopt import docopt
+from pathlib import Path
+
+# benchmark the package of the repository, without installing it
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bits.const import FILE_HEADER, QUEUE_HEADER, XFER_HEADER, \
+                       XFER_DELIMITER, JOB_DELIMITERS
+
+
+def pascal_utf16(value):
+    value += '\x00'
+    return struct.pack('<I', len(value)) + value.encode('utf-16-le')
+
+
+def filetime(rng):
+    # 2000-01-01 to 2030-01-01
+    return rng.randrange(125911584000000000, 135378720000000000)
+
+
+def sample_file(rng=None, index=0):
+    rng = rng or random.Random(0)
+    name = 'update%d.exe' % index
+    return b''.join((
+        pascal_utf16('C:\\Users\\user\\Downloads\\%s' % name),
+        pascal_utf16('http://example.com/%s' % name),
+        pascal_utf16('C:\\Users\\user\\Downloads\\BIT%04X.tmp' %
+                     rng.randrange(1 << 16)),
+        # sizes are kept away from the delimiters bytes
+        struct.pack('<QQB', 0x10203040 + rng.randrange(1 << 16),
+                    0x10203040 + rng.randrange(1 << 16), 1),
+        pascal_utf16('C:\\'),
+        pascal_utf16('\\\\?\\Volume{%08x-0000-0000-0000-000000000000}\\' %
+                     rng.randrange(1 << 32)),
+    ))
+
+
+def sample_metadata(rng=None):
+    rng = rng or random.Random(0)
+    ctime = filetime(rng)
+    return b''.join((
+        struct.pack('<I', 1),
+        struct.pack('<QIIIIB', 0x80200013, 1, 2, 3, 4, 0),
+        struct.pack('<III', 0, 600, 1209600),
+        struct.pack('<QQQ', ctime, ctime + 10, ctime + 20),
+        bytes(14),
+        struct.pack('<QQ', ctime + 30, ctime + 40),
+    ))
+
+
+def sample_job(rng=None, file_count=2):
+    rng = rng or random.Random(0)
+    return b''.join((
+        struct.pack('<IIII', 0, 2, rng.randrange(9), 0),
+        rng.getrandbits(128).to_bytes(16, 'little'),
+        pascal_utf16('job %d' % rng.randrange(1 << 16)),
+        pascal_utf16('scheduled update'),
+        pascal_utf16('C:\\Windows\\System32\\cmd.exe'),
+        pascal_utf16('/c exit'),
+        pascal_utf16('S-1-5-21-1004336348-1177238915-682003330-%d' %
+                     rng.randrange(500, 5000)),
+        struct.pack('<I', 11),
+        bytes(20),
+        bytes.fromhex(XFER_HEADER),
+        struct.pack('<I', file_count),
+        bytes.fromhex(XFER_DELIMITER).join(sample_file(rng, index)
+                                           for index in range(file_count)),
+        bytes.fromhex(XFER_HEADER),
+        sample_metadata(rng),
+    ))
+
+
+def sample_queue(rng=None, version=3, job_count=10):
+    rng = rng or random.Random(0)
+    delimiter = bytes.fromhex(JOB_DELIMITERS[version])
+    jobs = [sample_job(rng, rng.randrange(1, 4)) for _ in range(job_count)]
+    return b''.join((
+        bytes(4),
+        bytes.fromhex(FILE_HEADER),
+        bytes.fromhex(QUEUE_HEADER),
+        struct.pack('<I', job_count),
+        delimiter + delimiter.join(jobs) + delimiter,
+        bytes.fromhex(QUEUE_HEADER),
+        bytes(8),
+        bytes.fromhex(FILE_HEADER),
+    ))
+
+
+def noise(rng, size):
+    """Random bytes or zeroes."""
+    if size <= 0 or rng.random() < 0.3:
+        return bytes(max(0, size))
+    return rng.getrandbits(8 * size).to_bytes(size, 'little')
+
+
+def damage(rng, queue):
+    """Truncate a queue or overwrite a part of it."""
+    if rng.random() < 0.5:
+        return queue[rng.randrange(len(queue) // 2):]
+
+    start = rng.randrange(len(queue))
+    end = min(len(queue), start + rng.randrange(16, 512))
+    return queue[:start] + noise(rng, end - start) + queue[end:]
+
+
+def sample_image(rng=None, size=64, density=1, damaged=0.5, version=3):
+    """Build a disk image.
+
+    Args:
+        rng: random generator.
+        size: image size in MB.
+        density: count of queues per MB.
+        damaged: ratio of truncated or overwritten queues.
+        version: BITS version of the queues.
+
+    Returns: the image bytes and the count of jobs of the queues.
+    """
+    rng = rng or random.Random(0)
+    queue_count = max(1, int(size * density))
+    size = int(size * 1024 * 1024)
+
+    gap = size // queue_count
+
+    image = bytearray()
+    jobs = 0
+    for _ in range(queue_count):
+        job_count = rng.randrange(1, 8)
+        queue = sample_queue(rng, version, job_count)
+        if rng.random() < damaged:
+            queue = damage(rng, queue)
+        jobs += job_count
+
+        image += noise(rng, max(0, gap - len(queue)))
+        image += queue
+
+    image += noise(rng, max(0, size - len(image)))
+    return bytes(image), jobs
+
+
+if __name__ == '__main__':
+
+    args = docopt(__doc__)
+    rng = random.Random(int(args['--seed']))
+
+    if args['queue']:
+        data = sample_queue(rng, int(args['--version']), int(args['--jobs']))
+    else:
+        data, _ = sample_image(rng, float(args['--size']),
+                               float(args['--density']),
+                               float(args['--damage']),
+                               int(args['--version']))
+
+    with open(args['OUTPUT'], 'wb') as f:
+        f.write(data)
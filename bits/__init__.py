@@ -6,8 +6,16 @@
 
 import logging
 from bits.bits import Bits
-from bits.writer import write_csv
-from bits.sampler import sample_disk
+from bits.records import Job, FileTransfer
+from bits.writer import write_csv, write_jsonl, write_sqlite, WRITERS
+from bits.sampler import sample_disk, sample_stream, scan_disk
+from bits.dedup import deduplicate
+from bits.checkpoint import Checkpoint
+from bits.batch import find_queues, process_queues, process_data, \
+    with_source
+from bits.ntfs import ntfs_queues
+from bits.pipeline import pipeline, prefetch, process_pool
+from bits import metrics
 
 
 logger = logging.getLogger(__name__)
@@ -0,0 +1,147 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Analysis of many QMGR queues."""
+import glob
+import logging
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from itertools import chain
+from pathlib import Path
+
+from bits import metrics
+from bits.bits import Bits, _drop_streams
+from bits.dedup import deduplicate
+
+logger = logging.getLogger(__name__)
+
+
+QUEUE_PATTERN = 'qmgr*.dat'
+
+
+def find_queues(paths, pattern=QUEUE_PATTERN):
+    """Expand paths to QMGR queue files.
+
+    Files are kept as is, directories are searched recursively for files
+    matching `pattern` (case insensitive) and other paths are expanded as glob
+    patterns (`**` matching any subdirectory).
+
+    Args:
+        paths: file paths, directory paths or glob patterns.
+        pattern: queue file name pattern used in directories.
+
+    Returns: a sorted list of unique file paths.
+    """
+    def _in_dir(directory):
+        return (p for p in directory.rglob('*')
+                if p.is_file() and fnmatch(p.name.lower(), pattern.lower()))
+
+    rv = set()
+    for path in paths:
+        matches = [Path(path)] if Path(path).exists() else \
+            [Path(p) for p in glob.glob(path, recursive=True)]
+
+        if not matches:
+            logger.warning('%s: no such file or directory' % path)
+
+        for match in matches:
+            if match.is_dir():
+                rv.update(_in_dir(match))
+            else:
+                rv.add(match)
+
+    return sorted(rv)
+
+
+def with_source(jobs, source):
+    """Yield jobs with their source."""
+    for job in jobs:
+        job['source'] = str(source)
+        yield job
+
+
+def process_queue(fp, carving=True, delimiter=None, dedup=True, spill=None,
+                  carve_workers=1, fields=None):
+    """Parse, and carve, a QMGR queue file.
+
+    Args:
+        fp: QMGR queue file path.
+        carving: also carve the queue.
+        delimiter: force the job delimiter.
+        dedup: deduplicate the jobs of the queue.
+        spill: directory in which deduplication data is stored.
+        carve_workers: count of processes carving the queue in parallel.
+        fields: names of the fields to decode when parsing.
+
+    Returns: a list of the jobs of the queue, with their source.
+    """
+    metrics.count('batch.files')
+    try:
+        analyzer = Bits.load_file(fp, delimiter, fields)
+    except OSError as e:
+        logger.warning('%s: %s' % (fp, e))
+        return []
+
+    return _process(analyzer, fp, carving, dedup, spill, carve_workers)
+
+
+def process_data(data, source, carving=True, delimiter=None, dedup=True,
+                 spill=None, carve_workers=1, fields=None):
+    """Parse, and carve, the content of a QMGR queue.
+
+    Args:
+        data: content of a QMGR queue.
+        source: name of the queue, set as the source of its jobs.
+        others: see `process_queue`.
+
+    Returns: a list of the jobs of the queue, with their source.
+    """
+    metrics.count('batch.files')
+    analyzer = Bits.load_data(data, delimiter, fields)
+    return _process(analyzer, source, carving, dedup, spill, carve_workers)
+
+
+def _process(analyzer, source, carving, dedup, spill, carve_workers):
+    jobs = analyzer.parse()
+    if carving:
+        jobs = chain(jobs, analyzer.carve(workers=carve_workers))
+    if dedup:
+        jobs = deduplicate(jobs, spill)
+
+    rv = list(with_source(jobs, source))
+    for job in rv:
+        _drop_streams(job)  # not needed by writers, costly to transfer
+
+    return rv
+
+
+def process_queues(fps, workers=1, **kwargs):
+    """Process QMGR queue files, in parallel processes if requested.
+
+    The count of files processed ahead is limited to bound memory usage.
+
+    Args:
+        fps: QMGR queue file paths.
+        workers: count of processes handling files in parallel.
+        kwargs: arguments of `process_queue`.
+
+    Yields: the jobs of each file, in the order of the files.
+    """
+    if workers <= 1:
+        for fp in fps:
+            yield from process_queue(fp, **kwargs)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for fp in fps:
+            pending.append(metrics.submit(executor, process_queue, fp,
+                                          **kwargs))
+            if len(pending) >= 2 * workers:
+                yield from metrics.result(pending.popleft())
+
+        while pending:
+            yield from metrics.result(pending.popleft())
@@ -6,15 +6,99 @@
 import logging
 import construct.core
 
+from collections import Counter, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import chain, islice
 from pathlib import Path
 
+from bits import metrics
 from bits.structs import QUEUE, JOB, FILE
 from bits.const import JOB_DELIMITERS, XFER_DELIMITER
 from bits.carver import carve_queues, carve_jobs, carve_sections
+from bits.dedup import deduplicate
+from bits.records import Job, FileTransfer
 
 logger = logging.getLogger(__name__)
 
 
+DELIMITERS = [bytes.fromhex(d) for d in JOB_DELIMITERS.values()]
+
+
+def count_delimiters(data):
+    """Count the occurrences of each known job delimiter in bytes."""
+    return Counter({d: data.count(d) for d in DELIMITERS})
+
+
+def _drop_streams(obj):
+    """Remove the parsing streams left by construct in containers."""
+    if isinstance(obj, MutableMapping):
+        obj.pop('_io', None)
+        obj = obj.values()
+    elif not isinstance(obj, list):
+        return
+
+    for value in obj:
+        _drop_streams(value)
+
+
+def carve_job(data):
+    """Carve a job fragment.
+
+    Returns: the carved job or None when no relevant data is found.
+    """
+    with metrics.timer('carve'):
+        job, lost_bytes = carve_sections(data)
+    metrics.count('carve.fragments')
+    metrics.count('carve.lost_bytes', lost_bytes)
+
+    # no job data
+    if not job:
+        return None
+
+    # no value found
+    if not any(job.values()):
+        return None
+
+    # no file information
+    if job.get('file_count', 0) == 1 and \
+       not any(job['files'][0].values()):
+        return None
+
+    _drop_streams(job)
+    job = Job.from_mapping(job)
+    job['carved'] = True    # indicate the job was carved
+    metrics.count('carve.jobs')
+    return job
+
+
+def _carve_batch(fragments):
+    return [job for job in map(carve_job, fragments) if job is not None]
+
+
+def _next_done(pending, ordered=True):
+    """Remove and return the first pending future, or a completed one."""
+    if ordered:
+        return pending.popleft()
+
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    future = next(f for f in pending if f in done)
+    pending.remove(future)
+    return future
+
+
+def _strip_zeroes(offset, data):
+    """Strip the unwanted zeroes surrounding data.
+
+    Returns: the offset of the stripped data in its source, if `offset` is
+    set, and the stripped data.
+    """
+    stripped = data.lstrip(b'\x00')
+    if offset is not None:
+        offset += len(data) - len(stripped)
+    return offset, stripped.rstrip(b'\x00')
+
+
 class Bits:
     """
     An interface to store data and apply different strategies to extract job
@@ -22,16 +106,31 @@ class Bits:
 
     Args:
         delimiter: force the job delimiter.
+        fields: names of the fields to decode when parsing, the others being
+            left undecoded. All fields are decoded when not set.
     """
 
-    def __init__(self, delimiter=None):
+    def __init__(self, delimiter=None, fields=None):
 
-        self._raw_data = bytes()
-        self._bits_data = bytes()
+        # data is stored as lists of (offset, bytes) segments
+        self._raw_data = []
+        self._bits_data = []
+        self._counts = Counter()    # occurrences of each job delimiter
         self.delimiter = delimiter
+        self.fields = fields
+
+    @property
+    def raw_data(self):
+        """Raw data appended so far (concatenated segments)."""
+        return b''.join(data for _, data in self._raw_data)
+
+    @property
+    def bits_data(self):
+        """BITS data appended so far (concatenated segments)."""
+        return b''.join(data for _, data in self._bits_data)
 
     @classmethod
-    def load_file(cls, fp):
+    def load_file(cls, fp, delimiter=None, fields=None):
         """Create a Bits instance and load data from a QMGR file.
 
         This method is a simple helper to append the content of a file and
@@ -39,14 +138,28 @@ class Bits:
 
         Args:
             fp: file path to a QMGR file.
+            delimiter: force the job delimiter.
+            fields: names of the fields to decode when parsing.
         """
         logger.info('Processing BITS queue %s' % fp)
 
-        rv = cls()
-
         path = Path(fp).resolve()
         with path.open('rb') as f:
             data = f.read()
+
+        return cls.load_data(data, delimiter, fields)
+
+    @classmethod
+    def load_data(cls, data, delimiter=None, fields=None):
+        """Create a Bits instance and load the content of a QMGR file.
+
+        Args:
+            data: content of a QMGR file.
+            delimiter: force the job delimiter.
+            fields: names of the fields to decode when parsing.
+        """
+        rv = cls(delimiter, fields)
+
         try:
             content = QUEUE.parse(data)
             rv.append_data(content.jobs, raw=False)
@@ -56,35 +169,49 @@ class Bits:
 
         except construct.core.ConstructError as e:
             logger.warning('incoherent data, carving mode only.')
-            rv.append_data(data, raw=True)
+            rv.append_data(data, raw=True, offset=0)
 
         rv.guess_info()
         return rv
 
-    def append_data(self, data, raw=True):
+    def append_data(self, data, raw=True, offset=None):
         """Append data to analyze.
 
+        Each call appends a new segment, analyzed independently of the
+        others.
+
         Args:
             data: bytes to append.
             raw: true when appending unparsed raw data.
+            offset: offset of the data in its source, if any.
         """
-        data = data.strip(b'\x00')  # strip unwanted zeroes
+        offset, data = _strip_zeroes(offset, data)
+
         logger.debug('%d bytes loaded (raw=%s)' % (len(data), raw))
+        if not data:
+            return
+
+        self._counts.update(count_delimiters(data))
+
         if raw:
-            self._raw_data += data
+            self._raw_data.append((offset, data))
         else:
-            self._bits_data += data
+            self._bits_data.append((offset, data))
+
+    def guess_info(self, counts=None):
+        """Try to guess information from available data.
 
-    def guess_info(self):
-        """Try to guess information from available data."""
-        # select as candidate the known delimiter with the most occurences
-        data = self._bits_data + self._raw_data
+        Args:
+            counts: occurrences of each job delimiter (bytes), as counted by
+                `sample_disk`. Defaults to the occurrences counted when data
+                is appended.
+        """
+        if counts is None:
+            counts = self._counts
 
         if not self.delimiter:
-            count, candidate = max(
-                (data.count(bytes.fromhex(d)), bytes.fromhex(d))
-                for d in JOB_DELIMITERS.values()
-            )
+            # select as candidate the known delimiter with the most occurences
+            count, candidate = max((counts.get(d, 0), d) for d in DELIMITERS)
 
             self.delimiter = candidate if count else None
 
@@ -98,21 +225,27 @@ class Bits:
         """Parse and yield job data in BITS data structures.
 
         This method is based on expected data structures in a BITS queue and
-        works on well-formatted data.
+        works on well-formatted data. Only the `fields` of the instance are
+        decoded, if set.
 
         Yields: jobs.
         """
         xfer_delimiter = bytes.fromhex(XFER_DELIMITER)
 
         if self._bits_data and self.delimiter:
-            logger.debug('Analysis of %d bytes' % len(self._bits_data))
-            chunks = (j for j in self._bits_data.split(self.delimiter) if j)
+            logger.debug('Analysis of %d bytes' % sum(
+                len(segment) for _, segment in self._bits_data))
+            chunks = (j for _, segment in self._bits_data
+                      for j in segment.split(self.delimiter) if j)
             for data in chunks:
 
                 try:
-                    job = dict(JOB.parse(data))
+                    with metrics.timer('parse'):
+                        job = JOB.parse(data, fields=self.fields)
+                        job = Job.from_mapping(job)
                 except construct.core.ConstructError as e:
                     logger.debug('%d bytes of unknown data' % len(data))
+                    metrics.count('parse.unknown_bytes', len(data))
                     continue
 
                 xfers = (x for x in job.pop('files').split(xfer_delimiter))
@@ -120,20 +253,25 @@ class Bits:
 
                 for f in xfers:
                     try:
-                        job['files'].append(FILE.parse(f))
+                        with metrics.timer('parse'):
+                            job['files'].append(
+                                FileTransfer.from_mapping(
+                                    FILE.parse(f, fields=self.fields)))
                     except construct.core.ConstructError as e:
                         logger.debug('%d bytes of unknown data' % len(f))
+                        metrics.count('parse.unknown_bytes', len(f))
 
                 if job['file_count'] != len(job['files']):
                     err_msg = 'Invalid transfer count: %d found, %d expected.'
                     logger.warning(err_msg % (len(job['files']),
                                               job['file_count']))
 
+                metrics.count('parse.jobs')
                 yield job
         else:
             logger.info('No legitimate data found.')
 
-    def carve(self, raw=True):
+    def carve(self, raw=True, workers=1):
         """Search and yield job data in raw bytes by carving it.
 
         This method uses multiple functions to retrieve fragments of queues,
@@ -144,33 +282,96 @@ class Bits:
 
         Args:
             raw: carve raw bytes (default: True)
+            workers: count of processes carving job fragments in parallel.
 
         Yields: jobs or partial jobs.
         """
-        data = self._raw_data if raw else self._bits_data
-        logger.debug('Analysis of %d bytes' % len(data))
+        segments = self._raw_data if raw else self._bits_data
+        yield from self._carve_fragments(self._fragments(segments), workers)
 
-        for b_queue in carve_queues(data):
-            for b_job in carve_jobs(b_queue, self.delimiter):
-                    job, lost_bytes = carve_sections(b_job)
+    def stream(self, samples, prefix_size=65536, workers=1, ordered=True,
+               executor=None):
+        """Carve samples as soon as they are available, without storing them.
 
-                    # no job data
-                    if not job:
-                        continue
+        Memory usage does not depend on the amount of samples: each sample is
+        carved and dropped before the next one is read. When the job
+        delimiter is not set, it is guessed from the first samples.
 
-                    # no value found
-                    if not any(job.values()):
-                        continue
+        Args:
+            samples: iterable of (offset, bytes) samples, as yielded by
+                `sample_disk(..., offsets=True)`.
+            prefix_size: size in kB of the first samples used to guess the job
+                delimiter.
+            workers: count of processes carving job fragments in parallel.
+            ordered: yield jobs in the order of the samples. Otherwise, jobs
+                are yielded as soon as carved by a worker.
+            executor: optional pool of processes carving job fragments,
+                instead of a pool of `workers` processes.
 
-                    # no file information
-                    if job.get('file_count', 0) == 1 and \
-                       not any(job['files'][0].values()):
-                        continue
+        Yields: jobs or partial jobs.
+        """
+        samples = iter(samples)
 
-                    job['carved'] = True    # indicate the job was carved
+        if not self.delimiter:
+            prefix = []
+            size = 0
+            for offset, data in samples:
+                prefix.append((offset, data))
+                self._counts.update(count_delimiters(data))
+                size += len(data)
+                if size >= prefix_size * 1024:
+                    break
+
+            self.guess_info()
+            samples = chain(prefix, samples)
+
+        # strip unwanted zeroes, as when appending data
+        segments = (_strip_zeroes(offset, data) for offset, data in samples)
+        segments = ((offset, data) for offset, data in segments if data)
+        yield from self._carve_fragments(self._fragments(segments), workers,
+                                         ordered=ordered, executor=executor)
+
+    def _fragments(self, segments):
+        """Yield the job fragments of segments of data."""
+        for offset, data in segments:
+            logger.debug('Analysis of %d bytes (offset: %s)' % (len(data),
+                                                                 offset))
+            for b_queue in carve_queues(data):
+                yield from carve_jobs(b_queue, self.delimiter)
+
+    def _carve_fragments(self, fragments, workers=1, batch_size=64,
+                         ordered=True, executor=None):
+        """Carve job fragments, in parallel processes if requested.
+
+        Fragments are sent by batches to a pool of processes, `executor` when
+        given, and jobs are yielded in the order of the fragments, or in the
+        order the batches are carved if not `ordered`. The count of pending
+        batches is limited to bound memory usage.
+        """
+        if workers <= 1:
+            for fragment in fragments:
+                job = carve_job(fragment)
+                if job is not None:
                     yield job
+            return
+
+        if executor is None:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                yield from self._carve_fragments(fragments, workers,
+                                                 batch_size, ordered, executor)
+            return
+
+        pending = deque()
+        batch = list(islice(fragments, batch_size))
+        while batch:
+            pending.append(metrics.submit(executor, _carve_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from metrics.result(_next_done(pending, ordered))
+            batch = list(islice(fragments, batch_size))
+
+        while pending:
+            yield from metrics.result(_next_done(pending, ordered))
 
     def __iter__(self):
 
-        yield from self.parse()
-        yield from self.carve()
+        yield from deduplicate(chain(self.parse(), self.carve()))
@@ -7,8 +7,10 @@
 import logging
 import construct.core
 
-from bits.const import FILE_HEADER, QUEUE_HEADER, XFER_HEADER
-from bits.helpers.fields import PascalUtf16
+from io import BytesIO
+
+from bits.const import FILE_HEADER, QUEUE_HEADER, XFER_HEADER, SIZE_UNKNOWN
+from bits.helpers.fields import _decode_utf16
 from bits.structs import METADATA, \
                          FILE, FILE_PART_0, \
                          CONTROL_PART_0, CONTROL_PART_1
@@ -36,39 +38,89 @@ def carve_jobs(data, delimiter):
     return jobs
 
 
+def _valid_char(text, offset, valid):
+    """Tell if text[offset:] is valid UTF-8, knowing its valid suffixes."""
+    lead = text[offset]
+    if lead < 0x80:
+        size = 1
+    elif 0xC2 <= lead <= 0xDF:
+        size = 2
+    elif 0xE0 <= lead <= 0xEF:
+        size = 3
+    elif 0xF0 <= lead <= 0xF4:
+        size = 4
+    else:
+        return False
+
+    if offset + size > len(text) or not valid[offset + size]:
+        return False
+
+    try:
+        text[offset:offset + size].decode()
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
+
+def _rcarve_text(data):
+    """Decode the longest readable tail of bytes once zeroes are removed.
+
+    The even-sized tails of the data are decoded, from the shortest to the
+    longest, until one of them is not valid. Validity of the tails is
+    computed backward, one character at a time.
+
+    Returns: the text of the longest valid tail or None.
+    """
+    text = data.replace(b'\x00', b'')
+    valid = bytearray(len(text) + 1)    # valid[k]: text[k:] can be decoded
+    valid[len(text)] = True
+    done = len(text)                    # valid[done:] is computed
+
+    rv = None
+    k = len(text)
+    for j in range(2, len(data), 2):
+        # data[-j:] without its zeroes is text[k:]
+        k -= (data[-j] != 0) + (data[-j + 1] != 0)
+        while done > k:
+            done -= 1
+            valid[done] = _valid_char(text, done, valid)
+
+        if not valid[k]:
+            break
+        if k < len(text):
+            rv = k
+
+    return None if rv is None else text[rv:].decode()
+
+
 def rcarve_pascal_utf16(data, *fields):
-    """Search for utf16 fields in bytes."""
+    """Search for utf16 fields in bytes.
+
+    Fields are searched backward: a field is the last length-prefixed string
+    fitting in the data remaining before the previous field.
+    """
     rv = {}
-    remaining_data = None
+    view = memoryview(data)
+    end = len(data)     # data[:end] is not carved yet
 
     for field in fields:
-        valid_string = None
-
-        for i in range(len(data) - 4, -1, -2):
-            try:
-                valid_string = PascalUtf16().parse(data[i:])
-            except construct.core.ConstructError:
-                pass    # invalid data
-            else:
-                rv[field] = valid_string
-                data = data[:i]
-                remaining_data = data
+
+        for i in range(end - 4, -1, -2):
+            size = int.from_bytes(view[i:i + 4], byteorder='little') * 2
+            if i + 4 + size <= end:
+                rv[field] = _decode_utf16(bytes(view[i + 4:i + 4 + size]))
+                end = i
                 break
 
-        if valid_string is None:
-            remaining_data = None
+        else:
             # UGLY: extraction tentative of the remaining bytes
-            for j in range(2, len(data), 2):
-                try:
-                    res = data[-j:].replace(b'\x00', b'').decode()
-                except UnicodeDecodeError:
-                    break
-                else:
-                    if res:
-                        rv[field] = res
-            break       # no more data available
+            text = _rcarve_text(bytes(view[:end]))
+            if text:
+                rv[field] = text
+            return rv, None     # no more data available
 
-    return rv, remaining_data
+    return rv, bytes(view[:end]) if fields else None
 
 
 def files_deep_carving(data, pivot_offset):
@@ -131,6 +183,14 @@ def control_deep_carving(data, pivot_offset):
     return rv
 
 
+def partial_files_carving(data):
+    """Carve the remains of file transfers, pivoting on a temporary file."""
+    bittmp_index = data.find(b'.\x00t\x00m\x00p\x00')
+    if bittmp_index < 0:
+        return []
+    return files_deep_carving(data, bittmp_index + 10)
+
+
 def deep_carving(data):
     """Try to carve bytes for recognizable data."""
 
@@ -143,14 +203,11 @@ def deep_carving(data):
     pattern = b'S\x00-\x001\x00-\x00'
     sid_index = data.find(pattern)
 
-    pattern = b'.\x00t\x00m\x00p\x00'
-    bittmp_index = data.find(pattern)
-
     if sid_index > -1:
         rv.update(control_deep_carving(data, sid_index - 4))
 
-    elif bittmp_index > -1:
-        files = files_deep_carving(data, bittmp_index + 10)
+    else:
+        files = partial_files_carving(data)
         if files:
             rv['file_count'] = len(files)
             rv['files'] = files
@@ -158,6 +215,26 @@ def deep_carving(data):
     return rv
 
 
+def transfer_offsets(data, start=0):
+    """Yield plausible offsets of file transfers in bytes.
+
+    A file transfer starts with its destination path, a length-prefixed utf16
+    string starting with a drive letter (`X:`). Candidates are found in one
+    pass by searching for colons and checking their surroundings.
+    """
+    colon = b':\x00'
+    index = data.find(colon, start + 6)
+
+    while index >= 0:
+        offset = index - 6
+        if data[index - 1] == 0 and data[index - 2:index - 1].isalpha():
+            size = int.from_bytes(data[offset:offset + 4], byteorder='little')
+            if size >= 2 and offset + 4 + size * 2 <= len(data):
+                yield offset
+
+        index = data.find(colon, index + 2)
+
+
 def carve_sections(data):
     """Carve data has potential section in a job."""
     # A valid job is comprised of 2 to 3 sections:
@@ -185,26 +262,40 @@ def carve_sections(data):
 
         if file_count * 37 < len(section):
             logger.debug('trying to carve %d transfers' % file_count)
-            offset = 4
-            while file_count > len(files) and section[offset:]:
+            stream = BytesIO(section)
+            end = 4     # end of the last carved transfer
+            first = None    # offset of the first carved transfer
+            for offset in transfer_offsets(section, end):
+                if file_count <= len(files):
+                    break
+                if offset < end:
+                    continue    # inside the last carved transfer
+
+                # the parsing starts on the drive letter, FILE seeks back to
+                # the length prefix once the colon is found.
+                stream.seek(offset + 4)
                 try:
-                    recfile = FILE.parse(section[offset:])
+                    recfile = FILE.parse_stream(stream)
                     if any(v for k, v in recfile.items() if k != 'offset'):
                         files.append(recfile)
+                        if first is None:
+                            first = offset
 
                     # remove invalid transfer_size
-                    if recfile['transfer_size'] == 0xFFFFFFFFFFFFFFFF:
+                    if recfile['transfer_size'] == SIZE_UNKNOWN:
                         recfile['transfer_size'] = ''
 
                 except (UnicodeDecodeError, construct.core.ConstructError):
-                    offset += 1
-                    if offset == 16:   # don't waste time on irrelevant data.
-                        break          # 16 is an arbitrary high value
+                    continue
                 else:
-                    if files:
-                        logger.debug('new transfer found!')
-                        offset += recfile.offset  # the offset is now after the
-                                                  # newly carved file transfer
+                    logger.debug('new transfer found!')
+                    end = recfile.offset    # the offset is now after the
+                                            # newly carved file transfer
+
+            # the transfers preceding the first intact one are partially
+            # overwritten, their remains are carved as in deep carving.
+            if files and (first > 4 or len(files) < file_count):
+                files[:0] = partial_files_carving(section[:first])
 
         if files:
             rv['file_count'] = file_count
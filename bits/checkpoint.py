@@ -0,0 +1,186 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Disk analysis checkpoints."""
+import json
+import logging
+import os
+import time
+
+from pathlib import Path
+
+from bits.helpers.tools import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    """Progress of a disk image analysis, committed to files.
+
+    The state of the analysis (scan position, hits and count of samples) is
+    stored as JSON in `path`, the samples are appended to `path.samples`.
+    Each commit flushes the samples and replaces the state file atomically: an
+    interrupted analysis resumes from its last commit.
+
+    Args:
+        path: state file path.
+        interval: minimal delay in seconds between two commits.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path, interval=30):
+        self.path = Path(path)
+        self.samples_path = self.path.with_name(self.path.name + '.samples')
+        self.interval = interval
+        self.state = None
+        self._samples = None
+        self._patterns = None    # index of each pattern
+        self._commit_time = 0
+
+    @classmethod
+    def load(cls, path, interval=30):
+        """Load the checkpoint of a previous analysis."""
+        rv = cls(path, interval)
+        with rv.path.open('r') as f:
+            try:
+                rv.state = json.load(f)
+            except ValueError:
+                raise ValueError('invalid checkpoint %s' % path) from None
+
+        if not isinstance(rv.state, dict) or \
+                rv.state.get('version') != cls.VERSION:
+            raise ValueError('unsupported checkpoint version in %s' % path)
+
+        return rv
+
+    @property
+    def samples(self):
+        """Count of committed samples."""
+        return self.state['samples']
+
+    @staticmethod
+    def _params(img_fp, size, patterns, radiance):
+        return {
+            'image': str(img_fp),
+            'size': size,
+            'patterns': [p.hex() for p in patterns],
+            'radiance': radiance,
+        }
+
+    def _check(self, params):
+        for key, value in params.items():
+            if self.state.get(key) != value:
+                raise ValueError('checkpoint %s does not match the '
+                                 'analysis (%s)' % (self.path, key))
+
+    def check(self, img_fp, patterns, radiance):
+        """Check that a loaded checkpoint can resume an analysis.
+
+        Args:
+            img_fp: disk image file path.
+            patterns: searched patterns (bytes).
+            radiance: radiance in bytes.
+
+        Raises: ValueError if the checkpoint was stored by the analysis of
+            another image, or with other parameters.
+        """
+        img_fp = Path(img_fp).resolve()
+        with img_fp.open('rb') as f:
+            size = f.seek(0, 2)
+        self._check(self._params(img_fp, size, patterns, radiance))
+
+    def start(self, img_fp, size, patterns, radiance):
+        """Start or resume an analysis.
+
+        Args:
+            img_fp: disk image file path.
+            size: disk image size.
+            patterns: searched patterns (bytes).
+            radiance: radiance in bytes.
+
+        Returns: the scan position, the (offset, pattern) hits found so far
+            and the completion of the scan.
+        """
+        params = self._params(img_fp, size, patterns, radiance)
+
+        if self.state is None:
+            self.state = dict(params, version=self.VERSION, position=0,
+                              complete=False, hits=[], samples=0,
+                              samples_size=0)
+            self._samples = self.samples_path.open('wb')
+            self.commit(force=True)
+
+        else:
+            self._check(params)
+
+            # drop samples written after the last commit
+            self._samples = self.samples_path.open('r+b')
+            self._samples.truncate(self.state['samples_size'])
+            self._samples.seek(0, 2)
+            logger.info('checkpoint loaded: offset %d, %d samples',
+                        self.state['position'], self.samples)
+
+        self._patterns = {p: index for index, p in enumerate(patterns)}
+        hits = [(offset, patterns[index])
+                for offset, index in self.state['hits']]
+        return self.state['position'], hits, self.state['complete']
+
+    def scanned(self, position, hits, complete=False):
+        """Record the progress of the scan.
+
+        Args:
+            position: offset up to which the image is scanned.
+            hits: (offset, pattern) found since the last call.
+            complete: true when the whole image is scanned.
+        """
+        self.state['hits'].extend((offset, self._patterns[p])
+                                  for offset, p in hits)
+        self.state['position'] = position
+        self.state['complete'] = complete
+        self.commit(force=complete)
+
+    def replay(self, intervals):
+        """Read back the committed samples.
+
+        Args:
+            intervals: iterator of the (start, end) intervals of the samples,
+                the committed ones are consumed.
+
+        Yields: (start, sample) of each committed sample.
+        """
+        with self.samples_path.open('rb') as f:
+            for _ in range(self.samples):
+                start, end = next(intervals)
+                yield start, f.read(end - start)
+
+    def record(self, samples):
+        """Append samples to the checkpoint as they are yielded."""
+        for start, sample in samples:
+            self._samples.write(sample)
+            self.state['samples'] += 1
+            self.state['samples_size'] += len(sample)
+            self.commit()
+            yield start, sample
+
+    def commit(self, force=False):
+        """Flush the samples and store the state of the analysis.
+
+        Args:
+            force: commit even if the last commit is recent.
+        """
+        now = time.monotonic()
+        if not force and now - self._commit_time < self.interval:
+            return
+
+        self._samples.flush()
+        os.fsync(self._samples.fileno())
+        write_atomic(self.path, json.dumps(self.state).encode())
+        self._commit_time = now
+
+    def close(self):
+        """Commit and close the checkpoint."""
+        if self._samples is not None and not self._samples.closed:
+            self.commit(force=True)
+            self._samples.close()
@@ -9,6 +9,8 @@ QUEUE_HEADER =   '47445F00A9BDBA449851C47BB6C07ACE'
 XFER_HEADER =    '36DA56776F515A43ACAC44A248FFF34D'
 XFER_DELIMITER = '03000000'
 
+SIZE_UNKNOWN = 0xFFFFFFFFFFFFFFFF  # BG_SIZE_UNKNOWN, size of a file not known
+
 WINVER = {
     0: 'NT 5.1',    # Windows 2003 / Windows XP
     1: 'NT 5.2',    # Windows 2003 R2 / Windows XP 64
@@ -27,3 +29,8 @@ JOB_DELIMITERS = {
     4: 'B346ED3D3B10F944BC2FE8378BD31986',
     5: '74E70C81D2BBCC489E47862E8D58F3C6',
 }
+
+
+# markers searched in disk images.
+MARKERS = (XFER_HEADER, QUEUE_HEADER, FILE_HEADER) + \
+    tuple(JOB_DELIMITERS.values())
@@ -0,0 +1,173 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Deduplication of jobs."""
+import hashlib
+import logging
+import shelve
+import tempfile
+
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+from bits import metrics
+
+logger = logging.getLogger(__name__)
+
+# carved jobs waiting for a merge when streaming
+STREAM_WINDOW = 32
+
+
+def _filled(value):
+    """Tell if a carved value is relevant."""
+    return value is not None and value != '' and value != b'' and value != []
+
+
+def completeness(job):
+    """Count the relevant values of a job and its files."""
+    rv = sum(1 for k, v in job.items() if k != 'files' and _filled(v))
+    return rv + sum(completeness(f) for f in job.get('files', []))
+
+
+def fingerprint(job):
+    """Return a digest of the carved fields of a job."""
+    def _canonical(value):
+        if isinstance(value, Mapping):
+            return sorted((k, _canonical(v)) for k, v in value.items()
+                          if k not in ('_io', 'carved', 'offset'))
+        if isinstance(value, list):
+            return [_canonical(v) for v in value]
+        return value
+
+    return hashlib.blake2b(repr(_canonical(job)).encode(),
+                           digest_size=16).hexdigest()
+
+
+def merge(job, other):
+    """Merge two copies of a job into the most complete one.
+
+    The most complete copy is kept and its missing values are taken from the
+    other one.
+
+    Returns: the merged job.
+    """
+    if completeness(other) > completeness(job):
+        job, other = other, job
+
+    for key, value in other.items():
+        if key != 'files' and not _filled(job.get(key)) and _filled(value):
+            job[key] = value
+
+    if len(other.get('files', [])) > len(job.get('files', [])):
+        job['files'] = other['files']
+
+    return job
+
+
+class _Store:
+    """Seen fingerprints and pending jobs, in memory or spilled on disk."""
+
+    def __init__(self, spill=None):
+        self._tmp_dir = None
+        if spill is None:
+            self.fingerprints = set()
+            self.jobs = {}
+        else:
+            self._tmp_dir = tempfile.TemporaryDirectory(dir=str(spill))
+            path = Path(self._tmp_dir.name)
+            self.fingerprints = shelve.open(str(path / 'fingerprints'), 'n')
+            self.jobs = shelve.open(str(path / 'jobs'), 'n')
+
+    def add(self, digest):
+        """Record a fingerprint and tell if it was new."""
+        if digest in self.fingerprints:
+            return False
+        if isinstance(self.fingerprints, set):
+            self.fingerprints.add(digest)
+        else:
+            self.fingerprints[digest] = True
+        return True
+
+    def close(self):
+        if self._tmp_dir is not None:
+            self.fingerprints.close()
+            self.jobs.close()
+            self._tmp_dir.cleanup()
+
+
+def deduplicate(jobs, spill=None, window=None):
+    """Drop duplicated jobs and merge partial copies of the same job.
+
+    Legitimate (parsed) jobs are yielded as they come and their carved copies
+    are dropped. Carved jobs with an identifier are merged with the other
+    copies of the same job and yielded once all jobs are processed, or once
+    `window` other identifiers are pending, for a progressive output. Other
+    carved jobs, and copies of a job already yielded, are yielded unless an
+    identical copy was already seen.
+
+    Only fingerprints and jobs waiting for a merge are kept, optionally in
+    files of a temporary directory created in `spill`.
+
+    Args:
+        jobs: iterable of jobs.
+        spill: directory in which deduplication data is stored, in memory
+            when not set.
+        window: count of carved jobs waiting for a merge, the least recently
+            merged one being yielded first. Unbounded when not set.
+
+    Yields: unique jobs.
+    """
+    store = _Store(spill)
+    order = OrderedDict()   # identifiers of the pending jobs, LRU first
+    parsed = set()          # identifiers of the legitimate jobs
+    dropped = 0
+
+    def release(job_id):
+        nonlocal dropped
+        job = store.jobs.pop(job_id)
+        if job_id in parsed or not store.add(fingerprint(job)):
+            dropped += 1
+            return []
+        return [job]
+
+    try:
+        for job in jobs:
+            job_id = job.get('job_id')
+
+            if not job.get('carved'):
+                if job_id:
+                    parsed.add(job_id)
+                store.add(fingerprint(job))
+                yield job
+
+            elif job_id:
+                if job_id in parsed:
+                    dropped += 1
+                elif job_id in order:
+                    store.jobs[job_id] = merge(store.jobs[job_id], job)
+                    order.move_to_end(job_id)
+                    dropped += 1
+                else:
+                    store.jobs[job_id] = job
+                    order[job_id] = None
+                    if window is not None and len(order) > window:
+                        oldest, _ = order.popitem(last=False)
+                        yield from release(oldest)
+
+            elif store.add(fingerprint(job)):
+                yield job
+
+            else:
+                dropped += 1
+
+        while order:
+            job_id, _ = order.popitem(last=False)
+            yield from release(job_id)
+
+    finally:
+        store.close()
+
+    metrics.count('dedup.dropped', dropped)
+    logger.info('%d duplicated job(s) dropped or merged' % dropped)
@@ -2,28 +2,120 @@
 #
 # Licensed under the MIT License (the "License");
 # you may not use this file except in compliance with the License.
-"""Some helpers."""
+"""Some helpers.
+
+The adapters below can be compiled by construct: each of them emits a call to
+a module-level decoding function shared with its interpreted version.
+
+Fields wrapped in `Projected` are only decoded when requested by the `fields`
+parsing parameter, e.g. `JOB.parse(data, fields={'src_fn'})`.
+"""
 
 from uuid import UUID as _UUID
 from datetime import datetime, timedelta
-from construct import Adapter, Sequence, RepeatUntil, Byte, Bytes, Computed, \
-                      Int32ul, Seek, this, Container
+from io import BytesIO
+from construct import Adapter, Construct, Subconstruct, Sequence, Bytes, \
+                      Int32ul, this, Container, ConstructError, StreamError, \
+                      SizeofError
+from construct.core import stream_read, stream_tell, stream_seek, stream_write
 
+from bits import metrics
 
-class _StripDelimiter(Adapter):
 
-    def _decode(self, obj, context, path):
-        return bytes(obj[1])
+CHUNK_SIZE = 64 * 1024
+
+
+def _decode_utf16(data):
+    try:
+        return data.decode('utf16').strip('\x00')
+    except UnicodeDecodeError:
+        # TODO: improve that
+        return 'unreadable data'
+
+
+def _parse_utf16(stream, size, path):
+    return _decode_utf16(stream_read(stream, size * 2, path))
+
+
+def _parse_raw_utf16(stream, size, path):
+    return stream_read(stream, size * 2, path)
+
+
+def _decode_uuid(data):
+    return str(_UUID(bytes_le=data))
+
+
+def _decode_filetime(value):
+    return datetime(1601, 1, 1) + timedelta(microseconds=(value / 10))
+
+
+def _flatten(obj):
+    result = Container()
+    for key, value in obj.items():
+        if type(value) is Container:
+            result.update(value)
+        else:
+            result[key] = value
+
+    return result
+
+
+def _wanted(context, name):
+    fields = context['_params'].get('fields')
+    return fields is None or name in fields
+
+
+def _parse_delimited(stream, stop, path):
+    start = stream_tell(stream, path)
+
+    if isinstance(stream, BytesIO):
+        # no copy: the buffer is shared with the parsed bytes.
+        data = stream.getvalue()
+        end = data.find(stop, start)
+        if end < 0:
+            raise StreamError('delimiter %s not found' % stop.hex(), path=path)
+        stream_seek(stream, end, 0, path)
+        return data[start:end]
+
+    # generic stream: search chunk by chunk
+    data = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            raise StreamError('delimiter %s not found' % stop.hex(), path=path)
+        lookup = max(0, len(data) - len(stop) + 1)
+        data += chunk
+        end = data.find(stop, lookup)
+        if end >= 0:
+            stream_seek(stream, start + end, 0, path)
+            return bytes(data[:end])
 
 
 class _Utf16(Adapter):
 
     def _decode(self, obj, context, path):
-        try:
-            return obj[1].decode('utf16').strip('\x00')
-        except UnicodeDecodeError:
-            # TODO: improve that
-            return 'unreadable data'
+        return _decode_utf16(obj[1])
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _parse_utf16')
+        size_type = self.subcon.subcons[0]._compileparse(code)
+        return '_parse_utf16(io, %s, "(???)")' % size_type
+
+    @property
+    def raw(self):
+        return _RawUtf16(self.subcon)
+
+
+class _RawUtf16(Adapter):
+
+    def _decode(self, obj, context, path):
+        return obj[1]
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _parse_raw_utf16')
+        size_type = self.subcon.subcons[0]._compileparse(code)
+        return '_parse_raw_utf16(io, %s, "(???)")' % size_type
+
 
 class DateTime(Adapter):
 
@@ -34,24 +126,59 @@ class DateTime(Adapter):
 class UUID(Adapter):
 
     def _decode(self, obj, context, path):
-        return str(_UUID(bytes_le=obj))
+        return _decode_uuid(obj)
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _decode_uuid')
+        return '_decode_uuid(%s)' % self.subcon._compileparse(code)
+
+    @property
+    def raw(self):
+        return self.subcon
 
 
 class FileTime(Adapter):
 
     def _decode(self, obj, context, path):
-        return datetime(1601, 1, 1) + timedelta(microseconds=(obj / 10))
+        return _decode_filetime(obj)
 
-def DelimitedField(stop):
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _decode_filetime')
+        return '_decode_filetime(%s)' % self.subcon._compileparse(code)
 
-    return _StripDelimiter(Sequence(
-        'with_delimiter' / RepeatUntil(
-            lambda x, lst, ctx: lst[-len(stop):] == [int(c) for c in stop],
-            Byte
-        ),
-        'stripped' / Computed(this['with_delimiter'][:-len(stop)]),
-        Seek(-len(stop), whence=1)
-    ))
+    @property
+    def raw(self):
+        return self.subcon
+
+
+class DelimitedField(Construct):
+    """Parse bytes up to a delimiter.
+
+    The delimiter is searched with a single `find` over the stream buffer
+    instead of being matched byte by byte. The delimiter itself is not
+    consumed: the stream is left positioned on its first byte.
+
+    Args:
+        stop: the delimiter (bytes).
+    """
+
+    def __init__(self, stop):
+        super().__init__()
+        self.stop = stop
+
+    def _parse(self, stream, context, path):
+        return _parse_delimited(stream, self.stop, path)
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _parse_delimited')
+        return '_parse_delimited(io, %r, "(???)")' % (self.stop,)
+
+    def _build(self, obj, stream, context, path):
+        stream_write(stream, obj, len(obj), path)
+        return obj
+
+    def _sizeof(self, context, path):
+        raise SizeofError(path=path)
 
 
 def PascalUtf16(size_type=Int32ul):
@@ -63,14 +190,93 @@ def PascalUtf16(size_type=Int32ul):
     ))
 
 
+class Projected(Subconstruct):
+    """Decode a field only when it is requested.
+
+    Requested fields are given by name in the `fields` parsing parameter, all
+    fields being decoded when it is not set. Other fields are parsed but left
+    undecoded (raw bytes or integers).
+
+    Args:
+        subcon: a decoding adapter of this module.
+    """
+
+    def __init__(self, subcon):
+        super().__init__(subcon)
+        self.raw = subcon.raw
+        self.field = None
+
+    def __rtruediv__(self, name):
+        self.field = name
+        return super().__rtruediv__(name)
+
+    def _parse(self, stream, context, path):
+        if _wanted(context, self.field):
+            return self.subcon._parsereport(stream, context, path)
+        return self.raw._parsereport(stream, context, path)
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _wanted')
+        return '(%s if _wanted(this, %r) else %s)' % (
+            self.subcon._compileparse(code), self.field,
+            self.raw._compileparse(code))
+
+
 class FlattenStruct(Adapter):
-    
+
     def _decode(self, obj, context, path):
-        result = Container()
-        for key, value in obj.items():
-            if type(value) is Container:
-                result.update(value)
+        return _flatten(obj)
+
+    def _emitparse(self, code):
+        code.append('from bits.helpers.fields import _flatten')
+        return '_flatten(%s)' % self.subcon._compileparse(code)
+
+
+class CompiledStruct(Subconstruct):
+    """Parse a struct with its compiled version when available.
+
+    Compiled parsers do not check every read, so any error which is not a
+    construct error makes the parsing start over with the interpreted struct:
+    results are the same as the interpreted ones and invalid data still raises
+    a construct error. The interpreted struct is also used when the
+    compilation fails.
+
+    Successful and failed parsings are counted in the metrics, under the
+    `label` of the struct.
+
+    Args:
+        subcon: the struct to compile.
+        label: name of the struct in the metrics.
+    """
+
+    def __init__(self, subcon, label=None):
+        super().__init__(subcon)
+        self.label = label
+        try:
+            self.compiled = subcon.compile()
+        except Exception:
+            self.compiled = None
+
+    def _parse(self, stream, context, path):
+        try:
+            rv = self._parse_compiled(stream, context, path)
+        except Exception:
+            metrics.count('struct.%s.failed' % self.label)
+            raise
+        metrics.count('struct.%s.parsed' % self.label)
+        return rv
+
+    def _parse_compiled(self, stream, context, path):
+        if self.compiled is not None:
+            offset = stream_tell(stream, path)
+            try:
+                obj = self.compiled._parse(stream, context, path)
+            except ConstructError:
+                raise
+            except Exception:
+                stream_seek(stream, offset, 0, path)
             else:
-                result[key] = value
-        
-        return result
+                obj._io = stream    # as set by interpreted structs
+                return obj
+
+        return self.subcon._parse(stream, context, path)
@@ -3,6 +3,10 @@
 # Licensed under the MIT License (the "License");
 # you may not use this file except in compliance with the License.
 """Some helpers."""
+import os
+import tempfile
+
+from pathlib import Path
 
 
 def tcid(obj, key, default=None):
@@ -16,3 +20,23 @@ def btcid(obj, key, default=None):
     if hasattr(key, 'hex'):
         key = key.hex().upper()
     return tcid(obj, key, default)
+
+
+def write_atomic(fp, data):
+    """Replace the content of a file atomically.
+
+    Data is written to a temporary file of the same directory, flushed to disk
+    and renamed over the file: the file holds either its previous content or
+    the new one, never a partial write.
+    """
+    fp = Path(fp)
+    fd, tmp_fp = tempfile.mkstemp(prefix='.%s.' % fp.name, dir=str(fp.parent))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_fp, str(fp))
+    except BaseException:
+        os.unlink(tmp_fp)
+        raise
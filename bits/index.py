@@ -0,0 +1,108 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Index of the markers found in a disk image."""
+import json
+import logging
+
+from pathlib import Path
+
+from bits.helpers.tools import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_VERSION = 1
+
+
+def _image_info(img_fp):
+    """Return the size and modification time of a disk image."""
+    img_fp = Path(img_fp)
+    with img_fp.open('rb') as f:
+        size = f.seek(0, 2)     # also works on block devices
+    return size, img_fp.stat().st_mtime_ns
+
+
+def save_index(index_fp, img_fp, patterns, hits):
+    """Store the hits of a disk image scan.
+
+    Args:
+        index_fp: index file path.
+        img_fp: scanned disk image file path.
+        patterns: searched patterns (bytes).
+        hits: (offset, pattern) of each hit.
+    """
+    size, mtime = _image_info(img_fp)
+    position = {p: index for index, p in enumerate(patterns)}
+
+    data = {
+        'version': INDEX_VERSION,
+        'image': str(img_fp),
+        'size': size,
+        'mtime': mtime,
+        'patterns': [p.hex() for p in patterns],
+        'hits': [(offset, position[p]) for offset, p in hits],
+    }
+    write_atomic(index_fp, json.dumps(data).encode())
+    logger.info('%d hits stored in index %s', len(hits), index_fp)
+
+
+def _read_index(index_fp, img_fp, patterns):
+    """Return the content of an index and its patterns, once checked."""
+    with Path(index_fp).open('r') as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            raise ValueError('invalid index %s' % index_fp) from None
+
+    if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+        raise ValueError('unsupported index version in %s' % index_fp)
+
+    if (data.get('size'), data.get('mtime')) != _image_info(img_fp):
+        raise ValueError('index %s does not match %s (size or modification '
+                         'time changed)' % (index_fp, img_fp))
+
+    indexed = [bytes.fromhex(p) for p in data.get('patterns', [])]
+    missing = set(patterns) - set(indexed)
+    if missing:
+        raise ValueError('patterns %s not indexed in %s' % (
+            ', '.join(sorted(p.hex().upper() for p in missing)), index_fp))
+
+    return data, indexed
+
+
+def check_index(index_fp, img_fp, patterns):
+    """Check that the hits of an index can be loaded.
+
+    Args:
+        index_fp: index file path.
+        img_fp: scanned disk image file path.
+        patterns: searched patterns (bytes).
+
+    Raises: ValueError if the index was not built from the same image,
+        unmodified since, or does not contain all the patterns.
+    """
+    _read_index(index_fp, img_fp, patterns)
+
+
+def load_index(index_fp, img_fp, patterns):
+    """Load the hits of a disk image scan.
+
+    The index must have been built from the same image, unmodified since, and
+    contain all the patterns, other patterns are dropped.
+
+    Args:
+        index_fp: index file path.
+        img_fp: scanned disk image file path.
+        patterns: searched patterns (bytes).
+
+    Returns: a list of the (offset, pattern) of each hit.
+    """
+    data, indexed = _read_index(index_fp, img_fp, patterns)
+
+    wanted = set(patterns)
+    hits = [(offset, indexed[index]) for offset, index in data['hits']
+            if indexed[index] in wanted]
+    logger.info('%d hits loaded from index %s', len(hits), index_fp)
+    return hits
@@ -0,0 +1,154 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Processing metrics.
+
+Counters and timers of the processing stages, disabled by default: a disabled
+call only checks a flag. Pool workers send their metrics back along with their
+results (see `submit` and `result`). Updates are guarded by a lock, the stages
+of a pipeline running in threads.
+"""
+import cProfile
+import json
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Counters and cumulative timers (seconds)."""
+
+    def __init__(self):
+        self.enabled = False
+        self.counters = Counter()
+        self.timers = Counter()
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def collect(self):
+        """Return and reset the metrics."""
+        with self.lock:
+            rv = (self.counters, self.timers)
+            self.counters, self.timers = Counter(), Counter()
+        return rv
+
+    def merge(self, metrics):
+        """Add metrics returned by `collect`."""
+        counters, timers = metrics
+        with self.lock:
+            self.counters.update(counters)
+            self.timers.update(timers)
+
+
+class _Timer:
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.start
+        with METRICS.lock:
+            METRICS.timers[self.name] += duration
+
+
+class _NoTimer:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+METRICS = Metrics()
+_NO_TIMER = _NoTimer()
+
+
+def enable(enabled=True):
+    """Enable (or disable) metrics."""
+    METRICS.enabled = enabled
+
+
+def count(name, value=1):
+    """Increment a counter."""
+    if METRICS.enabled:
+        with METRICS.lock:
+            METRICS.counters[name] += value
+
+
+def timer(name):
+    """Return a context manager adding its duration to a timer."""
+    if METRICS.enabled:
+        return _Timer(name)
+    return _NO_TIMER
+
+
+def report():
+    """Return the metrics as a dictionary."""
+    with METRICS.lock:
+        return {
+            'counters': dict(sorted(METRICS.counters.items())),
+            'timers': {k: round(v, 6)
+                       for k, v in sorted(METRICS.timers.items())},
+        }
+
+
+def dump(fp):
+    """Write the metrics to a JSON file."""
+    with open(str(fp), 'w') as f:
+        json.dump(report(), f, indent=2)
+        f.write('\n')
+
+
+def _collected(enabled, func, *args, **kwargs):
+    METRICS.enabled = enabled
+    METRICS.reset()
+    rv = func(*args, **kwargs)
+    return rv, METRICS.collect()
+
+
+def submit(executor, func, *args, **kwargs):
+    """Submit a call to a process pool, its metrics being sent back."""
+    return executor.submit(_collected, METRICS.enabled, func, *args, **kwargs)
+
+
+def result(future):
+    """Return the result of a call submitted by `submit`, merging its metrics.
+    """
+    rv, metrics = future.result()
+    METRICS.merge(metrics)
+    return rv
+
+
+@contextmanager
+def profiled(fp=None):
+    """Profile the enclosed code with cProfile, if `fp` is set.
+
+    Statistics are dumped to `fp`, readable with `pstats`. Only the current
+    process is profiled.
+    """
+    if fp is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(fp))
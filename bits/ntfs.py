@@ -0,0 +1,485 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""NTFS volumes.
+
+Locate QMGR queues in the NTFS volumes of a disk image through the Master File
+Table (MFT), instead of scanning the whole image. Live and deleted file
+records are searched, as long as their record is still in the MFT.
+
+Only what is needed to read small files is supported: file records split over
+several MFT records (attribute lists), compressed and encrypted files are not.
+"""
+import logging
+import re
+import struct
+
+from fnmatch import fnmatch
+from pathlib import Path
+
+import construct.core
+
+from construct import Struct, Const, Bytes, Padding, If, Int8ul, Int8sl, \
+    Int16ul, Int32ul, Int64ul, this
+
+from bits.batch import QUEUE_PATTERN
+
+logger = logging.getLogger(__name__)
+
+
+# parent directories of the queues
+DOWNLOADER = ('microsoft', 'network', 'downloader')
+
+ROOT_RECORD = 5
+SECTOR_SIZE = 512       # MBR, GPT and update sequence stride
+MAX_DEPTH = 64          # of a path, to stop on loops of damaged records
+
+ATTR_FILE_NAME = 0x30
+ATTR_DATA = 0x80
+ATTR_END = 0xFFFFFFFF
+
+RECORD_IN_USE = 0x01
+RECORD_DIRECTORY = 0x02
+
+NAMESPACE_DOS = 2       # 8.3 names, secondary
+
+
+BOOT_SECTOR = Struct(
+    Padding(3),
+    Const(b'NTFS    '),
+    'bytes_per_sector'      / Int16ul,
+    'sectors_per_cluster'   / Int8ul,
+    Padding(0x30 - 0x0e),
+    'mft_lcn'               / Int64ul,
+    'mft_mirror_lcn'        / Int64ul,
+    'clusters_per_record'   / Int8sl,
+)
+
+
+RECORD_HEADER = Struct(
+    Const(b'FILE'),
+    'usa_offset'            / Int16ul,
+    'usa_count'             / Int16ul,
+    'lsn'                   / Int64ul,
+    'sequence'              / Int16ul,
+    'link_count'            / Int16ul,
+    'attrs_offset'          / Int16ul,
+    'flags'                 / Int16ul,
+    'used_size'             / Int32ul,
+    'allocated_size'        / Int32ul,
+    'base_record'           / Int64ul,
+)
+
+
+ATTRIBUTE = Struct(
+    'type'                  / Int32ul,
+    'length'                / Int32ul,
+    'non_resident'          / Int8ul,
+    'name_length'           / Int8ul,
+    'name_offset'           / Int16ul,
+    'flags'                 / Int16ul,
+    'id'                    / Int16ul,
+    'resident_attr'         / If(this.non_resident == 0, Struct(
+        'size'              / Int32ul,
+        'offset'            / Int16ul,
+    )),
+    'non_resident_attr'     / If(this.non_resident != 0, Struct(
+        'start_vcn'         / Int64ul,
+        'last_vcn'          / Int64ul,
+        'runs_offset'       / Int16ul,
+        'compression_unit'  / Int16ul,
+        Padding(4),
+        'allocated_size'    / Int64ul,
+        'real_size'         / Int64ul,
+        'initialized_size'  / Int64ul,
+    )),
+)
+
+
+FILE_NAME = Struct(
+    'parent'                / Int64ul,
+    Padding(0x38),
+    'name_length'           / Int8ul,
+    'namespace'             / Int8ul,
+    'name'                  / Bytes(this.name_length * 2),
+)
+
+
+def data_runs(runs):
+    """Decode a runlist.
+
+    Yields: (lcn, length) of each run, `lcn` being None for sparse runs.
+    """
+    lcn = 0
+    i = 0
+    while i < len(runs) and runs[i]:
+        length_size, offset_size = runs[i] & 0x0f, runs[i] >> 4
+        i += 1
+        length = int.from_bytes(runs[i:i + length_size], 'little')
+        i += length_size
+
+        if offset_size:
+            lcn += int.from_bytes(runs[i:i + offset_size], 'little',
+                                  signed=True)
+            i += offset_size
+            yield lcn, length
+        else:
+            yield None, length
+
+
+def _unfixup(record, usa_offset, usa_count):
+    """Restore the last bytes of each sector of a record, in place.
+
+    Returns: False if the record was partially written (torn).
+    """
+    usn = record[usa_offset:usa_offset + 2]
+    for i in range(1, usa_count):
+        end = i * SECTOR_SIZE
+        if end > len(record) or record[end - 2:end] != usn:
+            return False
+        usa = usa_offset + 2 * i
+        record[end - 2:end] = record[usa:usa + 2]
+    return True
+
+
+def _unfixup_records(data, record_size):
+    """Return a copy of consecutive records, their fixups applied.
+
+    Invalid and torn records are left as they are.
+    """
+    rv = bytearray(data)
+    for offset in range(0, len(rv) - record_size + 1, record_size):
+        if rv[offset:offset + 4] != b'FILE':
+            continue
+        usa_offset, usa_count = struct.unpack_from('<HH', rv, offset + 4)
+        record = rv[offset:offset + record_size]
+        if _unfixup(record, usa_offset, usa_count):
+            rv[offset:offset + record_size] = record
+    return rv
+
+
+def _glob_prefix(pattern):
+    """Case-insensitive regex of the UTF-16 literal prefix of a glob pattern.
+    """
+    prefix = re.split(r'[*?\[]', pattern)[0]
+    return re.compile(b''.join(
+        b'[%s%s]\x00' % (re.escape(c.lower().encode()),
+                         re.escape(c.upper().encode()))
+        if c.isalpha() else re.escape(c.encode('utf-16-le'))
+        for c in prefix))
+
+
+class FileRecord:
+    """A parsed MFT record: its header, names and unnamed data attribute."""
+
+    def __init__(self, number, header, names, data):
+        self.number = number
+        self.header = header
+        self.names = names      # (parent record, name) pairs
+        self.data = data        # the $DATA attribute, with its content
+
+    @property
+    def in_use(self):
+        return bool(self.header.flags & RECORD_IN_USE)
+
+    @property
+    def name(self):
+        """The long name of the file, or its DOS name."""
+        if not self.names:
+            return None
+        return self.names[0][1]
+
+    @property
+    def parent(self):
+        if not self.names:
+            return None
+        return self.names[0][0]
+
+
+class NtfsVolume:
+    """An NTFS volume of a disk image.
+
+    Args:
+        f: binary file object of the disk image.
+        offset: offset of the volume in the image.
+    """
+
+    def __init__(self, f, offset=0):
+        self.f = f
+        self.offset = offset
+
+        f.seek(offset)
+        boot = BOOT_SECTOR.parse(f.read(BOOT_SECTOR.sizeof()))
+
+        sectors_per_cluster = boot.sectors_per_cluster
+        if sectors_per_cluster > 0x80:      # large clusters, log2 encoded
+            sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+        self.cluster_size = boot.bytes_per_sector * sectors_per_cluster
+
+        if boot.clusters_per_record > 0:
+            self.record_size = boot.clusters_per_record * self.cluster_size
+        else:
+            self.record_size = 1 << -boot.clusters_per_record
+
+        if not self.cluster_size or not self.record_size:
+            raise ValueError('invalid NTFS boot sector at %d' % offset)
+
+        # the MFT is described by its first record, $MFT
+        f.seek(offset + boot.mft_lcn * self.cluster_size)
+        mft = self._parse_record(0, bytearray(f.read(self.record_size)))
+        if mft is None or mft.data is None or mft.data.runs is None:
+            raise ValueError('invalid MFT at %d' % offset)
+
+        self.mft_runs = mft.data.runs
+        self.mft_size = mft.data.size
+        logger.info('NTFS volume at offset %d, MFT of %d records', offset,
+                    self.mft_size // self.record_size)
+
+    def read_runs(self, runs, size, start=0):
+        """Read `size` bytes of data runs, from the byte `start`."""
+        chunks = []
+        vcn_offset = 0      # offset of the current run in the data
+        for lcn, length in runs:
+            run_size = length * self.cluster_size
+            lo = max(start, vcn_offset)
+            hi = min(start + size, vcn_offset + run_size)
+            if lo < hi and lcn is None:
+                chunks.append(bytes(hi - lo))
+            elif lo < hi:
+                self.f.seek(self.offset + lcn * self.cluster_size +
+                            lo - vcn_offset)
+                chunks.append(self.f.read(hi - lo))
+            vcn_offset += run_size
+            if vcn_offset >= start + size:
+                break
+
+        return b''.join(chunks)
+
+    def record(self, number):
+        """Return a parsed MFT record, or None if invalid."""
+        data = self.read_runs(self.mft_runs, self.record_size,
+                              number * self.record_size)
+        return self._parse_record(number, bytearray(data))
+
+    def records(self, chunk_size=1024):
+        """Yield the (number, raw data) of the records of the MFT.
+
+        Records are read by chunks of `chunk_size` records.
+        """
+        count = self.mft_size // self.record_size
+        for first in range(0, count, chunk_size):
+            size = min(chunk_size, count - first) * self.record_size
+            yield first, self.read_runs(self.mft_runs, size,
+                                        first * self.record_size)
+
+    def _parse_record(self, number, record):
+        try:
+            header = RECORD_HEADER.parse(record)
+        except construct.core.ConstructError:
+            return None
+        if not _unfixup(record, header.usa_offset, header.usa_count):
+            logger.debug('torn MFT record %d', number)
+            return None
+
+        names = []
+        data = None
+        offset = header.attrs_offset
+        end = min(header.used_size, len(record))
+        while offset + 8 <= end:
+            attr_type, length = struct.unpack_from('<II', record, offset)
+            if attr_type == ATTR_END or length == 0 or offset + length > end:
+                break
+
+            attr_data = record[offset:offset + length]
+            try:
+                attr = ATTRIBUTE.parse(attr_data)
+                if attr_type == ATTR_FILE_NAME and not attr.non_resident:
+                    names.append(self._file_name(attr, attr_data))
+                elif (attr_type == ATTR_DATA and not attr.name_length and
+                      data is None):
+                    data = self._data(attr, attr_data)
+            except (construct.core.ConstructError, UnicodeDecodeError):
+                logger.debug('invalid attribute in MFT record %d', number)
+            offset += length
+
+        # long names first
+        names = [(parent, name) for parent, name, namespace in
+                 sorted(names, key=lambda n: n[2] == NAMESPACE_DOS)]
+        return FileRecord(number, header, names, data)
+
+    @staticmethod
+    def _file_name(attr, attr_data):
+        resident = attr.resident_attr
+        content = attr_data[resident.offset:resident.offset + resident.size]
+        file_name = FILE_NAME.parse(content)
+        return (file_name.parent & 0xffffffffffff,
+                file_name.name.decode('utf-16-le'),
+                file_name.namespace)
+
+    @staticmethod
+    def _data(attr, attr_data):
+        rv = construct.Container(content=None, runs=None, size=0)
+        if not attr.non_resident:
+            resident = attr.resident_attr
+            rv.content = bytes(attr_data[resident.offset:
+                                         resident.offset + resident.size])
+            rv.size = resident.size
+        elif attr.non_resident_attr.start_vcn == 0:
+            rv.runs = list(data_runs(
+                attr_data[attr.non_resident_attr.runs_offset:]))
+            rv.size = attr.non_resident_attr.initialized_size
+        else:
+            return None     # continued by another record
+        return rv
+
+    def path(self, record, names=None):
+        """Return the components of the path of a record.
+
+        Args:
+            record: a `FileRecord`.
+            names: optional dictionary caching the (parent, name) of the
+                directories.
+        """
+        names = {} if names is None else names
+        rv = [record.name]
+        parent = record.parent
+        for _ in range(MAX_DEPTH):
+            if parent is None or parent == ROOT_RECORD:
+                break
+            if parent not in names:
+                directory = self.record(parent)
+                names[parent] = ((directory.parent, directory.name)
+                                 if directory is not None and directory.names
+                                 else (None, '?'))
+            parent, name = names[parent]
+            rv.append(name)
+
+        return list(reversed(rv))
+
+    def read(self, record):
+        """Return the content of the unnamed data attribute of a record."""
+        if record.data is None:
+            return b''
+        if record.data.content is not None:
+            return record.data.content
+        return self.read_runs(record.data.runs, record.data.size)
+
+    def find(self, pattern, parents=()):
+        """Search the MFT for files by name.
+
+        Args:
+            pattern: glob pattern of the file names (case insensitive).
+            parents: names of the last parent directories of the files (case
+                insensitive), if set.
+
+        Yields: (path components, record) of the matching files.
+        """
+        prefix = _glob_prefix(pattern)
+        pattern = pattern.lower()
+        parents = tuple(p.lower() for p in parents)
+        names = {}
+
+        for first, data in self.records():
+            # only parse the records holding the prefix of the name, searched
+            # once the last bytes of the sectors are restored.
+            fixed = _unfixup_records(data, self.record_size)
+            numbers = sorted(set(first + m.start() // self.record_size
+                                 for m in prefix.finditer(fixed)))
+            for number in numbers:
+                offset = (number - first) * self.record_size
+                record = self._parse_record(
+                    number, bytearray(data[offset:offset + self.record_size]))
+                if record is None or record.header.base_record or \
+                        record.header.flags & RECORD_DIRECTORY:
+                    continue
+                if not any(fnmatch(name.lower(), pattern)
+                           for _, name in record.names):
+                    continue
+
+                path = self.path(record, names)
+                if parents and tuple(p.lower() for p in
+                                     path[-len(parents) - 1:-1]) != parents:
+                    continue
+                yield path, record
+
+
+def find_volumes(f):
+    """Yield the offsets of the NTFS volumes of a disk image.
+
+    The image is either a volume or a disk partitioned with MBR or GPT
+    (extended partitions are not followed).
+    """
+    def is_ntfs(offset):
+        f.seek(offset)
+        return f.read(11)[3:] == b'NTFS    '
+
+    if is_ntfs(0):
+        yield 0
+        return
+
+    f.seek(0)
+    mbr = f.read(SECTOR_SIZE)
+    if len(mbr) < SECTOR_SIZE or mbr[510:512] != b'\x55\xaa':
+        return
+
+    starts = []
+    for i in range(4):
+        entry = mbr[446 + 16 * i:446 + 16 * (i + 1)]
+        part_type, = struct.unpack_from('<B', entry, 4)
+        lba, = struct.unpack_from('<I', entry, 8)
+        if part_type == 0xee:      # protective MBR of a GPT disk
+            starts = list(_gpt_starts(f))
+            break
+        if part_type:
+            starts.append(lba)
+
+    for lba in starts:
+        if lba and is_ntfs(lba * SECTOR_SIZE):
+            yield lba * SECTOR_SIZE
+
+
+def _gpt_starts(f):
+    """Yield the first LBA of the partitions of a GPT disk."""
+    f.seek(SECTOR_SIZE)
+    header = f.read(92)
+    if header[:8] != b'EFI PART':
+        return
+
+    entries_lba, count, entry_size = struct.unpack_from('<QII', header, 72)
+    f.seek(entries_lba * SECTOR_SIZE)
+    entries = f.read(count * entry_size)
+    for i in range(0, len(entries) - entry_size + 1, entry_size):
+        if entries[i:i + 16] != bytes(16):     # unused entry
+            lba, = struct.unpack_from('<Q', entries, i + 32)
+            yield lba
+
+
+def ntfs_queues(img_fp, pattern=QUEUE_PATTERN, parents=DOWNLOADER):
+    """Locate the QMGR queues of the NTFS volumes of a disk image.
+
+    Args:
+        img_fp: disk image file path.
+        pattern: glob pattern of the queue file names.
+        parents: names of the last parent directories of the queues.
+
+    Yields: (path, data) of each queue, `path` being the path of the queue in
+    its volume, prefixed by the volume offset when not 0.
+    """
+    img_fp = Path(img_fp).resolve()
+    with img_fp.open('rb') as f:
+        for offset in list(find_volumes(f)):
+            try:
+                volume = NtfsVolume(f, offset)
+            except (construct.core.ConstructError, ValueError) as e:
+                logger.warning('NTFS volume at %d: %s' % (offset, e))
+                continue
+
+            for path, record in volume.find(pattern, parents):
+                path = '\\'.join([''] + path)
+                if offset:
+                    path = '%d:%s' % (offset, path)
+                logger.info('queue %s found in MFT record %d%s', path,
+                            record.number,
+                            '' if record.in_use else ' (deleted)')
+                yield path, volume.read(record)
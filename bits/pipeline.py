@@ -0,0 +1,153 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Pipelined analysis of disk images.
+
+Each stage runs in its own thread and hands its items to the next one through
+a bounded queue: disk reads, carving and writing overlap, while a slow stage
+blocks the previous ones instead of letting items pile up in memory.
+
+Processes forked by a thread inherit the locks held by the other threads and
+may deadlock on them: the processes of the stages are started by the caller,
+before the threads (`process_pool`).
+"""
+import logging
+import queue
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()    # end of the items of a stage
+
+
+class _Failure:
+    """An exception raised by a stage, re-raised by the consumer."""
+
+    __slots__ = ('exception',)
+
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _put(items, item, stopped):
+    """Put an item in the queue, unless the consumer stopped."""
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(iterable, items, stopped, fetching):
+    try:
+        while True:
+            fetching.set()
+            try:
+                item = next(iterable)
+            except StopIteration:
+                break
+            finally:
+                fetching.clear()
+
+            if not _put(items, item, stopped):
+                return
+    except Exception as e:
+        _put(items, _Failure(e), stopped)
+    else:
+        _put(items, _DONE, stopped)
+    finally:
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+
+
+def prefetch(iterable, maxsize=8):
+    """Iterate over `iterable` in a thread, ahead of the consumer.
+
+    At most `maxsize` items are waiting to be consumed. An exception raised by
+    `iterable` is raised again when reaching it.
+
+    When the consumer stops early, the producer is waited for while it
+    releases its resources, but not while it computes its next item: it then
+    stops in the background, once the item is available.
+
+    Args:
+        iterable: items of the stage.
+        maxsize: count of items waiting in the queue.
+
+    Yields: the items of `iterable`.
+    """
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+    fetching = threading.Event()    # the producer waits for its next item
+
+    thread = threading.Thread(target=_produce, args=(iter(iterable), items,
+                                                     stopped, fetching),
+                              daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stopped.set()
+        while thread.is_alive() and not fetching.is_set():
+            thread.join(0.1)
+
+
+def process_pool(workers):
+    """Return a pool of `workers` processes, started before any stage.
+
+    Args:
+        workers: count of processes.
+
+    Returns: a `ProcessPoolExecutor`, shut down by the caller.
+    """
+    executor = ProcessPoolExecutor(max_workers=workers)
+    # the processes are forked on the first submission
+    executor.submit(int).result()
+    return executor
+
+
+def pipeline(samples, analyzer, workers=1, ordered=True, maxsize=8,
+             executor=None):
+    """Read and carve disk samples in concurrent stages.
+
+    Samples are read by a thread, carved by another one (along with `workers`
+    processes) and the jobs are yielded to the caller, usually a writer. Set
+    `ordered` to get the jobs in the order of a sequential analysis.
+
+    The processes are those of `executor`, which can be shared with the
+    sampler. Otherwise, a pool is started before the threads.
+
+    Args:
+        samples: iterable of (offset, bytes) samples, as yielded by
+            `sample_disk(..., offsets=True)`.
+        analyzer: a `Bits` object.
+        workers: count of processes carving job fragments in parallel.
+        ordered: yield jobs in the order of the samples.
+        maxsize: count of samples, or jobs, waiting between two stages.
+        executor: optional pool of processes, from `process_pool`.
+
+    Yields: jobs or partial jobs.
+    """
+    if executor is None and workers > 1:
+        with process_pool(workers) as executor:
+            yield from pipeline(samples, analyzer, workers, ordered, maxsize,
+                                executor)
+        return
+
+    samples = prefetch(samples, maxsize)
+    jobs = analyzer.stream(samples, workers=workers, ordered=ordered,
+                           executor=executor)
+    yield from prefetch(jobs, maxsize)
@@ -0,0 +1,132 @@
+# Copyright 2017 ANSSI. All Rights Reserved.
+#
+# Licensed under the MIT License (the "License");
+# you may not use this file except in compliance with the License.
+"""Job and file transfer records."""
+from collections.abc import MutableMapping
+
+
+class Record(MutableMapping):
+    """A compact record of known fields, usable as a mapping.
+
+    Values are stored in slots, with no dictionary per record. A field is in
+    the mapping once set: carved records only hold the fields found.
+
+    Args:
+        same as `dict`.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+    KEYS = frozenset()  # FIELDS, for lookups
+
+    def __init__(self, *args, **kwargs):
+        self.update(*args, **kwargs)
+
+    @classmethod
+    def from_mapping(cls, obj):
+        """Create a record from a mapping, construct private keys dropped."""
+        rv = cls()
+        keys = cls.KEYS
+        for key, value in obj.items():
+            if key in keys:
+                setattr(rv, key, value)
+            elif not key.startswith('_'):
+                raise KeyError('%s has no field %s' % (cls.__name__, key))
+        return rv
+
+    def __getitem__(self, key):
+        if key in self.KEYS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self.KEYS:
+            return getattr(self, key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        if key not in self.KEYS:
+            raise KeyError('%s has no field %s' % (type(self).__name__, key))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        try:
+            delattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % item for item in self.items()))
+
+
+class FileTransfer(Record):
+    """A file transfer of a job."""
+
+    __slots__ = FIELDS = (
+        'dest_fn',
+        'src_fn',
+        'tmp_fn',
+        'download_size',
+        'transfer_size',
+        'drive',
+        'vol_guid',
+        'offset',
+    )
+    KEYS = frozenset(FIELDS)
+
+
+class Job(Record):
+    """A BITS job, parsed or carved."""
+
+    __slots__ = FIELDS = (
+        'type',
+        'priority',
+        'state',
+        'job_id',
+        'name',
+        'desc',
+        'cmd',
+        'args',
+        'sid',
+        'flags',
+        'access_token',
+        'file_count',
+        'files',
+        'error_count',
+        'errors',
+        'transient_error_count',
+        'retry_delay',
+        'timeout',
+        'ctime',
+        'mtime',
+        'other_time0',
+        'other_time1',
+        'other_time2',
+        'carved',
+        'source',
+    )
+    KEYS = frozenset(FIELDS)
+
+    @classmethod
+    def from_mapping(cls, obj):
+        """Create a job from a mapping, files included."""
+        rv = super().from_mapping(obj)
+        if isinstance(rv.get('files'), list):
+            rv.files = [f if isinstance(f, FileTransfer) else
+                        FileTransfer.from_mapping(f) for f in rv.files]
+        return rv
@@ -3,83 +3,549 @@
 # Licensed under the MIT License (the "License");
 # you may not use this file except in compliance with the License.
 """Disk analysis features."""
+import errno
+import io
 import logging
+import os
 
-
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
 from pathlib import Path
 
+from bits import metrics
+from bits.index import load_index, save_index
+
 logger = logging.getLogger(__name__)
 
 
-def _radiance_read(f, start_offset, pattern, radiance):
+def _merge_windows(windows):
+    """Merge sorted windows surrounding hits into disjoint intervals.
 
-    # Radiance algorithm :
-    #
-    #      @0             @1             @2
-    #  <--------[pattern]----[pattern]-------->
-    #
-    # @0: predecessing bytes not containing the pattern.
-    # @1: intermediate data not containing the pattern with a size
-    #    inferior at the size of the radiance.
-    # @2: following bytes not containing the pattern.
-    #
-    # size(@0) == size(@2) == size(radiance)
-    # size(@1) < size(radiance)
+    Radiance algorithm :
 
-    # get predecessing bytes
-    f.seek(start_offset)
-    rv = f.read((radiance * 1024) + len(pattern))   # read @0 + 1st pattern
+         @0             @1             @2
+     <--------[pattern]----[pattern]-------->
 
-    while True:
-        rv_tmp = f.read(radiance * 1024)
+    @0: predecessing bytes not containing the pattern.
+    @1: intermediate data between two patterns.
+    @2: following bytes not containing the pattern.
+
+    size(@0) == size(@2) == size(radiance)
+    size(@1) <= 2 * size(radiance)
+
+    Yields: (start, end) offsets of each interval.
+    """
+    start = end = None
+
+    for lo, hi in windows:
+
+        if end is not None and lo <= end:     # overlapping windows
+            end = max(end, hi)
+            continue
+
+        if end is not None:
+            yield start, end
+        start, end = lo, hi
+
+    if end is not None:
+        yield start, end
+
+
+def _add_windows(windows, found, radiance, size=None):
+    """Merge the windows surrounding sorted hits into `windows`.
+
+    `windows` holds disjoint [start, end] windows, the last one growing with
+    the windows of the next hits overlapping it.
+    """
+    for offset, p in found:
+        lo, hi = max(0, offset - radiance), offset + len(p) + radiance
+        if size is not None:
+            hi = min(size, hi)
+        if windows and lo <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], hi)
+        else:
+            windows.append([lo, hi])
+
+
+def _complete_windows(windows, end, reach, final=False):
+    """Remove and yield the (start, end) of the complete windows.
+
+    A window is complete when a later window exists, or when the windows of
+    the next hits, starting after `end - reach`, cannot overlap it. All
+    windows are complete when `final` is set.
+    """
+    while windows and (final or len(windows) > 1 or
+                       windows[0][1] <= end - reach):
+        lo, hi = windows.pop(0)
+        yield lo, hi
+
+
+def _scan_windows(progress, matches, radiance, longest, size):
+    """Yield the merged windows of the hits as soon as the scan passes them.
+
+    progress: (position, hits) pairs of the scan, as yielded by
+        `_scan_progress`.
+    matches: list extended with the hits.
+
+    Yields: (start, end) offsets of each interval.
+    """
+    windows = []
+    for position, found in progress:
+        matches.extend(found)
+        _add_windows(windows, found, radiance, size)
+        yield from _complete_windows(windows, position, longest + radiance)
+
+    yield from _complete_windows(windows, size, 0, final=True)
+
+
+def _data_extents(f, start, stop):
+    """Yield the (start, end) extents of [start, stop) holding file data.
+
+    Holes of sparse files are found with `SEEK_DATA` and `SEEK_HOLE` and left
+    out. The whole range is yielded when the platform, the filesystem or the
+    file object does not support them.
+    """
+    try:
+        fd = f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        fd = None
+
+    if fd is None or not hasattr(os, 'SEEK_DATA'):
+        if start < stop:
+            yield start, stop
+        return
+
+    position = start
+    while position < stop:
+        try:
+            lo = os.lseek(fd, position, os.SEEK_DATA)
+            hi = os.lseek(fd, lo, os.SEEK_HOLE)
+        except OSError as e:
+            if e.errno != errno.ENXIO:      # not supported
+                yield position, stop
+            return                          # ENXIO: no data after position
+
+        if lo >= stop:
+            return
+        yield lo, min(hi, stop)
+        position = hi
+
+
+def _search(buf, patterns, carry, end, base, stop=None):
+    """Return the sorted (offset, pattern) found in buf[:end].
+
+    Patterns ending in the `carry` first bytes, reported with the previous
+    block, and patterns starting from `stop` are left out.
+    """
+    matches = []
+    for pattern in patterns:
+        local_offset = buf.find(pattern, max(0, carry - len(pattern) + 1), end)
+        while local_offset >= 0:
+            if stop is not None and base + local_offset >= stop:
+                break
+            matches.append((base + local_offset, pattern))
+            local_offset = buf.find(pattern, local_offset + 1, end)
+
+    metrics.count('scan.hits', len(matches))
+    return sorted(matches)
+
+
+def _scan_blocks(f, patterns, block_size, start=0, stop=None):
+    """Search a file for patterns, block by block.
+
+    The file is read once, by blocks, and all patterns are searched in each
+    block. The last bytes of a block are carried over the next one, so that
+    patterns overlapping two blocks are found. The file position is restored
+    before each read, the caller is free to seek between two blocks.
+
+    Holes of sparse files are not read and all-zero blocks are not searched:
+    only their edges can hold a pattern, unless a pattern is made of zeroes
+    only, in which case everything is searched.
+
+    Only patterns starting in [start, stop) are reported.
+
+    Yields: (position, hits) of each block, `position` being the offset of the
+    next block and `hits` the sorted (offset, pattern) found in the block.
+    """
+    overlap = max(len(p) for p in patterns) - 1
+    buf = bytearray(overlap + block_size)
+    view = memoryview(buf)
+    zeroes = memoryview(bytes(block_size))
+    skip_zeroes = all(p.strip(b'\x00') for p in patterns)
+
+    length = f.seek(0, 2)
+    if stop is not None:
+        length = min(length, stop + overlap)
+    if skip_zeroes:
+        extents = _data_extents(f, start, length)
+    else:
+        extents = iter([(start, length)])
+
+    position = start    # file offset of the next block
+    carry = 0           # size of the data carried over from the last block
+    holes = zero_blocks = 0
+
+    # the end of the file is the last hole, if any
+    for lo, hi in chain(extents, [(length, length)]):
+        if lo > position:
+            # only the first bytes of a hole can end a pattern
+            holes += lo - position
+            hole = min(lo - position, overlap)
+            end = carry + hole
+            buf[carry:end] = bytes(hole)
+            yield lo, _search(buf, patterns, carry, end, position - carry,
+                              stop)
+
+            position = lo
+            carry = min(overlap, end)
+            buf[:carry] = buf[end - carry:end]
+
+        while position < hi:
+            f.seek(position)
+            size = f.readinto(view[carry:carry + min(block_size,
+                                                     hi - position)])
+            if not size:
+                break
+
+            end = carry + size
+            metrics.count('scan.bytes', size)
+
+            # in an all-zero block, only the patterns starting in the carried
+            # data can be found.
+            search_end = end
+            if skip_zeroes and not buf[carry] and not buf[end - 1] and \
+                    buf[carry:end] == zeroes[:size]:
+                zero_blocks += size
+                search_end = min(end, carry + overlap)
+
+            hits = _search(buf, patterns, carry, search_end, position - carry,
+                           stop)
+            position += size
+            yield position, hits
+
+            carry = min(overlap, end)
+            buf[:carry] = buf[end - carry:end]
+
+    metrics.count('scan.sparse_bytes', holes)
+    metrics.count('scan.zero_bytes', zero_blocks)
+    if holes or zero_blocks:
+        logger.debug('%d bytes of holes skipped, %d zero bytes not searched',
+                     holes, zero_blocks)
+
+
+def _scan(f, patterns, block_size, start=0, stop=None):
+    """Yield the offset and the pattern of every pattern occurrence in a file.
+
+    Only patterns starting in [start, stop) are reported.
+    """
+    for _, hits in _scan_blocks(f, patterns, block_size, start, stop):
+        yield from hits
 
-        if len(rv_tmp) < radiance * 1024:               # end of the file
-            return rv + rv_tmp
 
-        local_offset = rv_tmp.rfind(pattern)
-        if local_offset >= 0:                           # intermediate pattern
-            rv += rv_tmp[:local_offset + len(pattern)]
-            f.seek(f.tell() - (radiance * 1024) + local_offset + len(pattern))
+def _read(f, intervals):
+    """Yield the (start, data) of each (start, end) interval of a file."""
+    for start, end in intervals:
+        with metrics.timer('sample.read'):
+            f.seek(start)
+            data = f.read(end - start)
+        yield start, data
+
+
+def _patterns(pattern):
+    """Return a tuple of bytes patterns from one or many patterns."""
+    if isinstance(pattern, (bytes, str)):
+        pattern = (pattern, )
+
+    # ensure patterns are bytes
+    return tuple(bytes.fromhex(p) if isinstance(p, str) else bytes(p)
+                 for p in pattern)
+
+
+def _scan_shard(img_fp, patterns, block_size, start, stop):
+    with img_fp.open('rb') as f:
+        return list(_scan(f, patterns, block_size, start, stop))
+
+
+def _scan_shards(img_fp, size, patterns, block_size, workers, start=0,
+                 executor=None):
+    """Scan byte-range shards of a disk image in a pool of processes.
+
+    Shards overlap by the size of the longest pattern, so hits crossing a
+    shard boundary are found, and are reported once. The shards are scanned
+    by `executor` when given, by a pool of `workers` processes otherwise.
+
+    Yields: (position, hits) of each shard, `position` being the end of the
+    shard and `hits` the sorted (offset, pattern) found in the shard.
+    """
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from _scan_shards(img_fp, size, patterns, block_size,
+                                    workers, start, executor)
+        return
+
+    # a few shards per worker, aligned on the block size, to balance the load
+    shard_size = -(-(size - start) // (workers * 4))
+    shard_size = max(1, -(-shard_size // block_size)) * block_size
+
+    shards = [(offset, min(size, offset + shard_size))
+              for offset in range(start, size, shard_size)]
+    logger.debug('scan of %d shards of %d bytes', len(shards), shard_size)
+
+    futures = [metrics.submit(executor, _scan_shard, img_fp, patterns,
+                              block_size, start, stop)
+               for start, stop in shards]
+    for (_, stop), future in zip(shards, futures):
+        yield stop, metrics.result(future)
+
+
+def _scan_progress(img_fp, patterns, block_size, workers=1, start=0,
+                   executor=None):
+    """Search a disk image for patterns and report the progress of the scan.
+
+    Yields: (position, hits) pairs, `position` being the offset up to which
+    the image is scanned and `hits` the (offset, pattern) found since the
+    previous pair.
+    """
+    with img_fp.open('rb') as f:
+        if workers > 1:
+            size = f.seek(0, 2)
+            yield from _scan_shards(img_fp, size, patterns, block_size,
+                                    workers, start, executor)
         else:
-            return rv + rv_tmp                          # pattern not found
+            yield from _scan_blocks(f, patterns, block_size, start)
+
+
+def scan_disk(img_fp, pattern, block_size=4096, workers=1):
+    """Search a disk image for one or many patterns in a single pass.
+
+    img_fp: disk image file path.
+    pattern: bytes or hex-string of a specific pattern, or a list of them.
+    block_size: size in kB of the blocks read when scanning the image.
+    workers: count of processes scanning shards of the image in parallel.
+
+    Yields: (offset, pattern) of each hit.
+    """
+    img_fp = Path(img_fp).resolve()
+    patterns = _patterns(pattern)
 
+    for _, hits in _scan_progress(img_fp, patterns, block_size * 1024,
+                                  workers):
+        yield from hits
 
-def sample_disk(img_fp, pattern, radiance=4096):
-    """Extract interesting disk image samples containing a specific pattern.
+
+def sample_disk(img_fp, pattern, radiance=4096, block_size=4096, hits=None,
+                workers=1, offsets=False, checkpoint=None, index=None,
+                progressive=False, executor=None):
+    """Extract interesting disk image samples containing specific patterns.
+
+    The image is processed in two phases: the offsets of the patterns are
+    collected first, then the windows of data surrounding them are merged and
+    each resulting interval is read once. When `progressive` is set, each
+    merged window is read as soon as the scan passes it instead.
 
     img_fp: disk image file path.
-    pattern: bytes or hex-string of the specific pattern.
+    pattern: bytes or hex-string of a specific pattern, or a list of them.
     radiance: size in kB of collected data not containing the pattern
         surrounding the matched pattern.
+    block_size: size in kB of the blocks read when scanning the image.
+    hits: optional `collections.Counter` updated with the count of hits of
+        each pattern.
+    workers: count of processes scanning shards of the image in parallel.
+    offsets: yield the offset of each sample along with it.
+    checkpoint: optional `Checkpoint` storing the progress of the analysis,
+        resumed from its last commit when loaded from a previous analysis.
+    index: optional index file path. The hits are loaded from the index when
+        it exists, instead of scanning the image, and stored in it otherwise.
+    progressive: read the windows during the scan. Ignored along with a
+        checkpoint or an index.
+    executor: optional pool of processes scanning the shards of the image.
 
-    Yields: disk samples (bytes)
+    Yields: disk samples (bytes), or (offset, sample) when `offsets` is set.
     """
 
     img_fp = Path(img_fp).resolve()
+    patterns = _patterns(pattern)
 
     logger.info('disk analysis of %s', img_fp)
-    logger.info('search for pattern 0x%s R:%d', pattern, radiance)
+    for p in patterns:
+        logger.info('search for pattern 0x%s R:%d', p.hex().upper(), radiance)
 
-    # ensure pattern is bytes
-    if isinstance(pattern, str):
-        pattern = bytes.fromhex(pattern)
+    if hits is None:
+        hits = Counter()
 
-    buf = [bytearray(512), bytearray(512)]  # dual buffer
+    radiance *= 1024
+    # a checkpoint and an index record the whole scan first
+    progressive = progressive and checkpoint is None and index is None
 
     with img_fp.open('rb') as f:
-        while f.readinto(buf[1]):
-            data = b''.join(buf)
+        size = f.seek(0, 2)
+
+    if checkpoint is None:
+        position, matches, complete = 0, [], False
+    else:
+        position, matches, complete = checkpoint.start(img_fp, size, patterns,
+                                                       radiance)
 
-            local_offset = data.find(pattern, 511-len(pattern))
-            if local_offset >= 0:
+    try:
+        if progressive:
+            # both phases at once: windows are read as soon as the scan
+            # passes them.
+            longest = max(len(p) for p in patterns)
+            intervals = _scan_windows(
+                _scan_progress(img_fp, patterns, block_size * 1024, workers,
+                               executor=executor),
+                matches, radiance, longest, size)
 
-                # absolute offset of the pattern in the file.
-                abs_offset = f.tell() - 1024 + local_offset
+        # phase 1: collect hits
+        elif not complete and index is not None and Path(index).exists():
+            known = set(matches)
+            found = [m for m in load_index(index, img_fp, patterns)
+                     if m not in known]
+            matches = sorted(matches + found)
+            if checkpoint is not None:
+                checkpoint.scanned(size, found, complete=True)
 
-                # radiance start offset
-                start_offset = max(0, abs_offset - (radiance * 1024))
-                yield _radiance_read(f, start_offset, pattern, radiance)
+        elif not complete:
+            # hits ending before the position were committed, the scan starts
+            # over where the unreported ones could begin.
+            start = max(0, position - max(len(p) for p in patterns) + 1)
+            known = set(m for m in matches if m[0] >= start)
+            if position:
+                logger.info('scan resumed at offset %d (%d hits)', position,
+                            len(matches))
 
-            buf.reverse()   # permute the list
+            with metrics.timer('scan'):
+                for position, found in _scan_progress(img_fp, patterns,
+                                                      block_size * 1024,
+                                                      workers, start,
+                                                      executor):
+                    found = [m for m in found if m not in known]
+                    matches.extend(found)
+                    if checkpoint is not None:
+                        checkpoint.scanned(position, found)
 
+            if known:
+                matches.sort()
+            if checkpoint is not None:
+                checkpoint.scanned(size, [], complete=True)
+
+        if not progressive:
+            if index is not None and not Path(index).exists():
+                save_index(index, img_fp, patterns, matches)
+
+            intervals = _merge_windows(
+                (max(0, offset - radiance),
+                 min(size, offset + len(p) + radiance))
+                for offset, p in matches)
+
+        # phase 2: read merged windows
+        read = count = 0
+        with img_fp.open('rb') as f:
+            samples = _read(f, intervals)
+            if checkpoint is not None:
+                # committed samples are read back from the checkpoint
+                samples = chain(checkpoint.replay(intervals),
+                                checkpoint.record(samples))
+
+            for start, sample in samples:
+                read += len(sample)
+                count += 1
+                yield (start, sample) if offsets else sample
+
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+    hits.update(p for _, p in matches)
+
+    requested = sum(min(size, offset + len(p) + radiance) -
+                    max(0, offset - radiance) for offset, p in matches)
+    metrics.count('sample.hits', len(matches))
+    metrics.count('sample.windows', count)
+    metrics.count('sample.bytes', read)
+    metrics.count('sample.bytes_saved', requested - read)
+
+    logger.info('%d hits merged in %d windows, %d bytes read (%d saved)',
+                len(matches), count, read, requested - read)
     logger.info('disk analysis complete')
+
+
+def sample_stream(stream, pattern, radiance=4096, block_size=4096, hits=None,
+                  offsets=False):
+    """Extract samples containing specific patterns from a forward-only stream.
+
+    The stream is read once, without seeking: the last `radiance` kB are kept
+    in memory to build the window preceding each hit, and the data following
+    a hit is kept until its window is complete. Samples are the same as those
+    of `sample_disk` on a file with the same content.
+
+    stream: binary file object (pipe, standard input, ...).
+    pattern: bytes or hex-string of a specific pattern, or a list of them.
+    radiance: size in kB of collected data not containing the pattern
+        surrounding the matched pattern.
+    block_size: size in kB of the blocks read from the stream.
+    hits: optional `collections.Counter` updated with the count of hits of
+        each pattern.
+    offsets: yield the offset of each sample along with it.
+
+    Yields: disk samples (bytes), or (offset, sample) when `offsets` is set.
+    """
+    patterns = _patterns(pattern)
+
+    logger.info('stream analysis of %s', getattr(stream, 'name', stream))
+    for p in patterns:
+        logger.info('search for pattern 0x%s R:%d', p.hex().upper(), radiance)
+
+    if hits is None:
+        hits = Counter()
+
+    radiance *= 1024
+    block_size *= 1024
+    longest = max(len(p) for p in patterns)
+
+    buf = bytearray()
+    base = 0            # stream offset of buf[0]
+    windows = []        # merged [start, end] windows, the last one growing
+    matches = read = count = 0
+
+    while True:
+        data = stream.read(block_size)
+        carry = len(buf)
+        buf += data
+        end = base + len(buf)   # stream offset of the end of the data
+        metrics.count('scan.bytes', len(data))
+
+        found = _search(buf, patterns, carry, len(buf), base)
+        hits.update(p for _, p in found)
+        matches += len(found)
+
+        _add_windows(windows, found, radiance)
+
+        # the data of a complete window is read: it ends before the next
+        # window, or before end - longest - radiance.
+        for lo, hi in _complete_windows(windows, end, longest + radiance,
+                                        final=not data):
+            sample = bytes(buf[lo - base:min(hi, end) - base])
+            read += len(sample)
+            count += 1
+            yield (lo, sample) if offsets else sample
+
+        if not data:
+            break
+
+        # drop the data no window can start in
+        keep = end - longest - radiance
+        if windows:
+            keep = min(keep, windows[0][0])
+        if keep - base > block_size:
+            del buf[:keep - base]
+            base = keep
+
+    metrics.count('sample.hits', matches)
+    metrics.count('sample.windows', count)
+    metrics.count('sample.bytes', read)
+
+    logger.info('%d hits merged in %d windows, %d bytes read', matches,
+                count, read)
+    logger.info('stream analysis complete')
@@ -47,7 +47,8 @@ jobs ->
     other_time1
     other_time2
 
-
+Strings and times are only decoded when requested by the `fields` parsing
+parameter, if set (see `bits.helpers.fields.Projected`).
 """
 
 # available fields
@@ -56,9 +57,10 @@ jobs ->
 
 from bits.const import FILE_HEADER, QUEUE_HEADER, XFER_HEADER
 
-from bits.helpers.fields import DelimitedField, PascalUtf16, FileTime, UUID, FlattenStruct
+from bits.helpers.fields import DelimitedField, PascalUtf16, FileTime, UUID, \
+    FlattenStruct, CompiledStruct, Projected
 from construct import Struct, Array, Enum, Const, GreedyBytes, Int64ul, \
-    Int32ul, Bytes, Byte, Pass, Padding, Tell, Seek, this
+    Int32ul, Bytes, Byte, Padding, Tell, Seek, this
 
 
 QUEUE = Struct(
@@ -76,16 +78,16 @@ QUEUE = Struct(
 
 # CONTROL : job control informations
 CONTROL_PART_0 = Struct(
-    'type'          / Enum(Int32ul, default=Pass,
+    'type'          / Enum(Int32ul,
         download=0,
         upload=1,
         upload_reply=2),
-    'priority'      / Enum(Int32ul, default=Pass,
+    'priority'      / Enum(Int32ul,
         foreground=0,
         high=1,
         normal=2,
         low=3),
-    'state'         / Enum(Int32ul, default=Pass,
+    'state'         / Enum(Int32ul,
         queued=0,
         connecting=1,
         transferring=2,
@@ -101,8 +103,8 @@ CONTROL_PART_0 = Struct(
 
 
 CONTROL_PART_1 = Struct(
-    'sid'           / PascalUtf16(Int32ul),
-    'flags'         / Enum(Int32ul, default=Pass,
+    'sid'           / Projected(PascalUtf16(Int32ul)),
+    'flags'         / Enum(Int32ul,
         BG_NOTIFY_JOB_TRANSFERRED=1,
         BG_NOTIFY_JOB_ERROR=2,
         BG_NOTIFY_JOB_TRANSFERRED_BG_NOTIFY_JOB_ERROR=3,
@@ -117,10 +119,10 @@ CONTROL_PART_1 = Struct(
 
 CONTROL = FlattenStruct(Struct(
     'control_part_0' / CONTROL_PART_0,
-    'name'          / PascalUtf16(Int32ul),
-    'desc'          / PascalUtf16(Int32ul),
-    'cmd'           / PascalUtf16(Int32ul),
-    'args'          / PascalUtf16(Int32ul),
+    'name'          / Projected(PascalUtf16(Int32ul)),
+    'desc'          / Projected(PascalUtf16(Int32ul)),
+    'cmd'           / Projected(PascalUtf16(Int32ul)),
+    'args'          / Projected(PascalUtf16(Int32ul)),
     'control_part_1' / CONTROL_PART_1,
     'access_token'  / DelimitedField(bytes.fromhex(XFER_HEADER)),
 ))
@@ -132,8 +134,8 @@ FILE_PART_0 = Struct(
     'download_size' / Int64ul,
     'transfer_size' / Int64ul,
     Byte,
-    'drive'         / PascalUtf16(Int32ul),
-    'vol_guid'      / PascalUtf16(Int32ul),
+    'drive'         / Projected(PascalUtf16(Int32ul)),
+    'vol_guid'      / Projected(PascalUtf16(Int32ul)),
     'offset'        / Tell,                     # required by carving
 )
 
@@ -141,9 +143,9 @@ FILE_PART_0 = Struct(
 FILE = FlattenStruct(Struct(
     DelimitedField(b':'),
     Seek(-6, whence=1),
-    'dest_fn'       / PascalUtf16(Int32ul),
-    'src_fn'        / PascalUtf16(Int32ul),
-    'tmp_fn'        / PascalUtf16(Int32ul),     # always ends with .tmp
+    'dest_fn'       / Projected(PascalUtf16(Int32ul)),
+    'src_fn'        / Projected(PascalUtf16(Int32ul)),
+    'tmp_fn'        / Projected(PascalUtf16(Int32ul)),  # ends with .tmp
     'file_part_0' / FILE_PART_0,
 ))
 
@@ -164,12 +166,12 @@ METADATA = Struct(
     'transient_error_count' / Int32ul,
     'retry_delay'   / Int32ul,
     'timeout'       / Int32ul,
-    'ctime'         / FileTime(Int64ul),
-    'mtime'         / FileTime(Int64ul),
-    'other_time0'   / FileTime(Int64ul),
+    'ctime'         / Projected(FileTime(Int64ul)),
+    'mtime'         / Projected(FileTime(Int64ul)),
+    'other_time0'   / Projected(FileTime(Int64ul)),
     Padding(14),
-    'other_time1'   / FileTime(Int64ul),
-    'other_time2'   / FileTime(Int64ul),
+    'other_time1'   / Projected(FileTime(Int64ul)),
+    'other_time2'   / Projected(FileTime(Int64ul)),
 )
 
 
@@ -181,3 +183,13 @@ JOB = FlattenStruct(Struct(
     Const(bytes.fromhex(XFER_HEADER)),
     'metadata' / METADATA,
 ))
+
+
+# compiled parsers (the interpreted structs are used as fallback)
+QUEUE = CompiledStruct(QUEUE, 'QUEUE')
+CONTROL_PART_0 = CompiledStruct(CONTROL_PART_0, 'CONTROL_PART_0')
+CONTROL_PART_1 = CompiledStruct(CONTROL_PART_1, 'CONTROL_PART_1')
+FILE_PART_0 = CompiledStruct(FILE_PART_0, 'FILE_PART_0')
+FILE = CompiledStruct(FILE, 'FILE')
+METADATA = CompiledStruct(METADATA, 'METADATA')
+JOB = CompiledStruct(JOB, 'JOB')
@@ -2,8 +2,16 @@
 #
 # Licensed under the MIT License (the "License");
 # you may not use this file except in compliance with the License.
-"""CSV writer."""
+"""Writers."""
 import csv
+import json
+import sqlite3
+
+from datetime import datetime
+from itertools import islice
+
+from bits import metrics
+from bits.const import SIZE_UNKNOWN
 
 
 DEFAULT_VALUES = (
@@ -30,9 +38,17 @@ DEFAULT_VALUES = (
     ('other_time0', None),
     ('other_time1', None),
     ('other_time2', None),
-    ('carved', False)
+    ('carved', False),
+    ('source', None),
 )
 
+FILE_KEYS = ('dest_fn', 'src_fn', 'tmp_fn', 'download_size', 'transfer_size',
+             'drive', 'vol_guid')
+
+JOB_VALUES = tuple((k, v) for k, v in DEFAULT_VALUES
+                   if k not in FILE_KEYS and k != 'file_id')
+FILE_VALUES = tuple((k, v) for k, v in DEFAULT_VALUES if k in FILE_KEYS)
+
 
 def flattener(job):
 
@@ -49,13 +65,143 @@ def flattener(job):
     return [_f(0, {})]
 
 
-def write_csv(filename, records):
-    """Write records to a CSV file."""
+def _project(values, fields):
+    """Keep the (key, default) values of the requested fields, if any."""
+    if fields is None:
+        return values
+    return tuple((k, v) for k, v in values if k in fields)
+
+
+def rows(job, values=DEFAULT_VALUES):
+    """Yield the values of the rows of a job, one row per file."""
+    files = job.get('files') or [{}]
+
+    for index, file in enumerate(files):
+        yield [index if k == 'file_id' else file.get(k, job.get(k, v))
+               for k, v in values]
+
+
+def write_csv(filename, records, fields=None):
+    """Write records to a CSV file.
+
+    Only the columns of `fields` are written, if set.
+    """
+    values = _project(DEFAULT_VALUES, fields)
 
     with filename.open('w') as csvfile:
-        writer = csv.DictWriter(csvfile,
-                                fieldnames=[k for k, _ in DEFAULT_VALUES])
-        writer.writeheader()
+        writer = csv.writer(csvfile)
+        writer.writerow([k for k, _ in values])
+        for r in records:
+            job_rows = list(rows(r, values))
+            writer.writerows(job_rows)
+            metrics.count('write.jobs')
+            metrics.count('write.rows', len(job_rows))
+
+
+def normalizer(job, job_values=JOB_VALUES, file_values=FILE_VALUES):
+    """Return the job values and the values of each of its files."""
+    values = {k: job.get(k, v) for k, v in job_values}
+    files = [{k: f.get(k, v) for k, v in file_values}
+             for f in job.get('files', [])]
+    return values, files
+
+
+def write_jsonl(filename, records, fields=None):
+    """Write records to a JSON Lines file, one job per line.
+
+    Only the values of `fields` are written, if set.
+    """
+    job_values = _project(JOB_VALUES, fields)
+    file_values = _project(FILE_VALUES, fields)
+
+    with filename.open('w') as jsonfile:
         for r in records:
-            for sub_r in flattener(r):
-                writer.writerow(sub_r)
+            values, files = normalizer(r, job_values, file_values)
+            if file_values:
+                values['files'] = files
+            jsonfile.write(json.dumps(values, default=str) + '\n')
+            metrics.count('write.jobs')
+            metrics.count('write.rows')
+
+
+def _sql_value(value):
+    if isinstance(value, datetime):
+        return str(value)
+    if isinstance(value, str):
+        return str(value)   # enum values are str subclasses
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+        # out of the range of SQLite integers: unknown sizes are NULL, other
+        # values are stored as text.
+        return None if value == SIZE_UNKNOWN else str(value)
+    return value
+
+
+def _create_table(db, name, columns):
+    db.execute('CREATE TABLE IF NOT EXISTS %s (%s)' % (
+        name, ', '.join('"%s" %s' % column for column in columns)))
+
+
+def write_sqlite(filename, records, fields=None, batch_size=1000):
+    """Write records to a SQLite database.
+
+    Jobs and files are stored in the `jobs` and `files` tables, each file
+    referencing its job. Records are inserted by batches, each batch in a
+    transaction. Records are appended when the database already exists.
+    Only the columns of `fields` are written, if set.
+    """
+    job_values = _project(JOB_VALUES, fields)
+    file_values = _project(FILE_VALUES, fields)
+    job_keys = [k for k, _ in job_values]
+    file_keys = ['job', 'file_id'] + [k for k, _ in file_values]
+
+    db = sqlite3.connect(str(filename))
+    try:
+        with db:
+            _create_table(db, 'jobs', [('id', 'INTEGER PRIMARY KEY')] +
+                          [(k, '') for k in job_keys])
+            _create_table(db, 'files', [('id', 'INTEGER PRIMARY KEY'),
+                                        ('job', 'REFERENCES jobs(id)')] +
+                          [(k, '') for k in file_keys[1:]])
+
+        insert_job = 'INSERT INTO jobs (%s) VALUES (%s)' % (
+            ', '.join('"%s"' % k for k in ['id'] + job_keys),
+            ', '.join('?' * (len(job_keys) + 1)))
+        insert_file = 'INSERT INTO files (%s) VALUES (%s)' % (
+            ', '.join('"%s"' % k for k in file_keys),
+            ', '.join('?' * len(file_keys)))
+
+        # jobs identifiers are set here to insert files along with their jobs
+        job_id, = db.execute('SELECT COALESCE(MAX(id), 0) '
+                             'FROM jobs').fetchone()
+
+        records = iter(records)
+        batch = list(islice(records, batch_size))
+        while batch:
+            jobs, files = [], []
+            for r in batch:
+                job_id += 1
+                values, job_files = normalizer(r, job_values, file_values)
+                jobs.append([job_id] + [_sql_value(values[k])
+                                        for k in job_keys])
+                files.extend([job_id, index] + [_sql_value(v)
+                                                for v in f.values()]
+                             for index, f in enumerate(job_files))
+
+            with db:
+                db.executemany(insert_job, jobs)
+                db.executemany(insert_file, files)
+            metrics.count('write.jobs', len(jobs))
+            metrics.count('write.rows', len(jobs) + len(files))
+
+            batch = list(islice(records, batch_size))
+    finally:
+        db.close()
+
+
+WRITERS = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'sqlite': write_sqlite,
+}
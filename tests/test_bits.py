@@ -0,0 +1,30 @@
+"""Tests of the Bits analyzer."""
+from bits import Bits
+from bits.const import JOB_DELIMITERS
+
+SAMPLES = [
+    (0, b'\x00\x00abc\x00'),
+    (100, b'\x00' * 16),        # dropped
+    (200, b'def'),
+    (300, b'\x00\x00\x00gh\x00i\x00\x00'),
+]
+
+
+def test_stream_segments(monkeypatch):
+    # the segments carved by stream are those stored by append_data
+    delimiter = JOB_DELIMITERS[1]
+    analyzer = Bits(delimiter)
+    for offset, data in SAMPLES:
+        analyzer.append_data(data, offset=offset)
+
+    streamed = []
+
+    def fragments(self, segments):
+        streamed.extend(segments)
+        return iter(())
+
+    monkeypatch.setattr(Bits, '_fragments', fragments)
+    assert list(Bits(delimiter).stream(SAMPLES)) == []
+    assert streamed == analyzer._raw_data == [
+        (2, b'abc'), (200, b'def'), (303, b'gh\x00i'),
+    ]
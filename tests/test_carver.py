@@ -0,0 +1,165 @@
+"""Tests of the carver."""
+import random
+import struct
+
+import construct.core
+import pytest
+
+from construct import Adapter, Sequence, Bytes, Int32ul, this
+
+from bits.carver import carve_sections, rcarve_pascal_utf16
+from bits.const import XFER_DELIMITER
+
+
+class _Utf16(Adapter):
+
+    def _decode(self, obj, context, path):
+        try:
+            return obj[1].decode('utf16').strip('\x00')
+        except UnicodeDecodeError:
+            return 'unreadable data'
+
+
+def ReferencePascalUtf16():
+    return _Utf16(Sequence(
+        'size_type' / Int32ul,
+        Bytes(this['size_type'] * 2),
+    ))
+
+
+def reference_rcarve_pascal_utf16(data, *fields):
+    """The quadratic implementation rcarve_pascal_utf16 replaces."""
+    rv = {}
+    remaining_data = None
+
+    for field in fields:
+        valid_string = None
+
+        for i in range(len(data) - 4, -1, -2):
+            try:
+                valid_string = ReferencePascalUtf16().parse(data[i:])
+            except construct.core.ConstructError:
+                pass    # invalid data
+            else:
+                rv[field] = valid_string
+                data = data[:i]
+                remaining_data = data
+                break
+
+        if valid_string is None:
+            remaining_data = None
+            for j in range(2, len(data), 2):
+                try:
+                    res = data[-j:].replace(b'\x00', b'').decode()
+                except UnicodeDecodeError:
+                    break
+                else:
+                    if res:
+                        rv[field] = res
+            break       # no more data available
+
+    return rv, remaining_data
+
+
+def pascal_utf16(value):
+    value += '\x00'
+    return struct.pack('<I', len(value)) + value.encode('utf-16-le')
+
+
+def transfer(index):
+    name = 'update%d.exe' % index
+    return b''.join((
+        pascal_utf16('C:\\Users\\user\\Downloads\\%s' % name),
+        pascal_utf16('http://example.com/%s' % name),
+        pascal_utf16('C:\\Users\\user\\Downloads\\BIT%04X.tmp' % index),
+        struct.pack('<QQB', 0x10203040 + index, 0x10203140 + index, 1),
+        pascal_utf16('C:\\'),
+        pascal_utf16('\\\\?\\Volume{%08x-0000-0000-0000-000000000000}\\' %
+                     index),
+    ))
+
+
+def transfers_section(*transfers):
+    return struct.pack('<I', len(transfers)) + \
+        bytes.fromhex(XFER_DELIMITER).join(transfers)
+
+
+def test_intact_transfers():
+    rv, lost_bytes = carve_sections(transfers_section(transfer(0),
+                                                      transfer(1)))
+
+    assert lost_bytes == 0
+    assert rv['file_count'] == 2
+    assert [f['dest_fn'] for f in rv['files']] == [
+        'C:\\Users\\user\\Downloads\\update0.exe',
+        'C:\\Users\\user\\Downloads\\update1.exe',
+    ]
+
+
+def test_damaged_first_transfer():
+    # the destination of the first transfer is overwritten, its remains are
+    # carved along with the next, intact, transfer.
+    damaged = bytearray(transfer(0))
+    damaged[:40] = b'\xaa' * 40
+
+    rv, _ = carve_sections(transfers_section(bytes(damaged), transfer(1)))
+
+    assert rv['file_count'] == 2
+    assert len(rv['files']) == 2
+
+    partial, intact = rv['files']
+    assert partial['src_fn'] == 'http://example.com/update0.exe'
+    assert partial['tmp_fn'] == 'C:\\Users\\user\\Downloads\\BIT0000.tmp'
+    assert partial['download_size'] == 0x10203040
+    assert partial['transfer_size'] == 0x10203140
+    assert partial['drive'] == 'C:\\'
+    assert partial['vol_guid'] == \
+        '\\\\?\\Volume{00000000-0000-0000-0000-000000000000}\\'
+    assert intact['dest_fn'] == 'C:\\Users\\user\\Downloads\\update1.exe'
+    assert intact['tmp_fn'] == 'C:\\Users\\user\\Downloads\\BIT0001.tmp'
+
+
+FIELDS = ('tmp_fn', 'src_fn', 'dest_fn')
+
+TEXTS = ['C:\\Windows', 'http://example.com/', 'r\u00e9sum\u00e9',
+         '\u20ac', '\U0001f600', '']
+
+
+def random_chunk(rng):
+    kind = rng.randrange(5)
+    text = rng.choice(TEXTS)
+    if kind == 0:       # random bytes
+        return rng.getrandbits(8 * 16).to_bytes(16, 'little')
+    if kind == 1:       # UTF-8 text, possibly cut in a character
+        data = text.encode('utf-8')
+        return data[:rng.randrange(len(data) + 1)]
+    if kind == 2:       # UTF-8 text interleaved with zeroes
+        return b''.join(bytes([c, 0]) for c in text.encode('utf-8'))
+    if kind == 3:       # Pascal string
+        return pascal_utf16(text)
+    # truncated Pascal string
+    data = pascal_utf16(text)
+    return data[:rng.randrange(len(data) + 1)]
+
+
+@pytest.mark.parametrize('data', [
+    b'',
+    b'\x00\x00\x00',
+    pascal_utf16('C:\\a') + pascal_utf16('http://b') + pascal_utf16('c'),
+    b'r\xc3\xa9sum' + pascal_utf16('b') + pascal_utf16('c'),
+    b'\xe2\x82' + pascal_utf16('c'),                 # truncated character
+    pascal_utf16('abc')[:-3] + pascal_utf16('c'),   # truncated string
+    b'\x00a\x00b\x00\xe2\x82\xac' + pascal_utf16('c'),
+])
+def test_rcarve_pascal_utf16(data):
+    assert rcarve_pascal_utf16(data, *FIELDS) == \
+        reference_rcarve_pascal_utf16(data, *FIELDS)
+
+
+def test_rcarve_pascal_utf16_random():
+    rng = random.Random(0)
+    for _ in range(2000):
+        data = b''.join(random_chunk(rng) for _ in range(rng.randrange(5)))
+        fields = FIELDS[:rng.randrange(len(FIELDS) + 1)]
+        assert rcarve_pascal_utf16(data, *fields) == \
+            reference_rcarve_pascal_utf16(data, *fields)
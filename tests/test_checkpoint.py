@@ -0,0 +1,50 @@
+"""Tests of the disk analysis checkpoints."""
+import pytest
+
+from bits.checkpoint import Checkpoint
+
+PATTERNS = [b'\x13\xf7\x2b\xc8']
+
+
+@pytest.fixture
+def analysis(tmp_path):
+    img_fp = (tmp_path / 'image.bin').resolve()
+    img_fp.write_bytes(bytes(4096))
+    checkpoint = Checkpoint(tmp_path / 'image.ckpt')
+    checkpoint.start(img_fp, 4096, PATTERNS, 1024)
+    checkpoint.close()
+    return img_fp, tmp_path / 'image.ckpt'
+
+
+def test_check(analysis):
+    img_fp, checkpoint_fp = analysis
+    Checkpoint.load(checkpoint_fp).check(img_fp, PATTERNS, 1024)
+
+
+@pytest.mark.parametrize('patterns, radiance', [
+    (PATTERNS, 2048),
+    (PATTERNS + [b'\x47\x44'], 1024),
+])
+def test_check_parameters(analysis, patterns, radiance):
+    img_fp, checkpoint_fp = analysis
+    with pytest.raises(ValueError):
+        Checkpoint.load(checkpoint_fp).check(img_fp, patterns, radiance)
+
+
+def test_check_image(analysis):
+    img_fp, checkpoint_fp = analysis
+    img_fp.write_bytes(bytes(8192))
+    with pytest.raises(ValueError):
+        Checkpoint.load(checkpoint_fp).check(img_fp, PATTERNS, 1024)
+
+
+@pytest.mark.parametrize('content', [b'garbage', b'1', b'{"version": 0}'])
+def test_load_invalid(tmp_path, content):
+    (tmp_path / 'image.ckpt').write_bytes(content)
+    with pytest.raises(ValueError):
+        Checkpoint.load(tmp_path / 'image.ckpt')
+
+
+def test_load_missing(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Checkpoint.load(tmp_path / 'image.ckpt')
@@ -0,0 +1,111 @@
+"""Tests of the fields helpers."""
+import io
+import random
+
+import pytest
+
+from construct import Adapter, Sequence, RepeatUntil, Byte, Computed, Seek, \
+    Struct, GreedyBytes, this
+from construct.core import StreamError
+
+from bits.helpers.fields import DelimitedField, CHUNK_SIZE
+
+
+class _StripDelimiter(Adapter):
+
+    def _decode(self, obj, context, path):
+        return bytes(obj[1])
+
+
+def ReferenceDelimitedField(stop):
+    """The byte by byte implementation DelimitedField replaces."""
+    return _StripDelimiter(Sequence(
+        'with_delimiter' / RepeatUntil(
+            lambda x, lst, ctx: lst[-len(stop):] == [int(c) for c in stop],
+            Byte
+        ),
+        'stripped' / Computed(this['with_delimiter'][:-len(stop)]),
+        Seek(-len(stop), whence=1)
+    ))
+
+
+def parse(field, data, stream_type=io.BytesIO):
+    """Return the parsed value and the stream position, or the exception."""
+    stream = stream_type(data)
+    try:
+        value = field.parse_stream(stream)
+    except StreamError as e:
+        return type(e)
+    return value, stream.tell()
+
+
+def buffered(data):
+    """A stream that is not a BytesIO, read by chunks."""
+    return io.BufferedReader(io.BytesIO(data))
+
+
+CASES = [
+    (b'\x01\x02', b'abc\x01\x02def'),
+    (b'\x01\x02', b'\x01\x02'),                 # empty value
+    (b'aab', b'xaaab'),                         # overlapping delimiter
+    (b'aab', b'aaaab'),
+    (b'\x00\x00', b'\x01\x00\x00\x00'),
+    (b'\x00\x00\x00\x01', b'\x00\x00\x00\x00\x00\x01rest'),
+    (b'\xff', b'\xff\xff\xff'),
+]
+
+
+@pytest.mark.parametrize('stream_type', [io.BytesIO, buffered])
+@pytest.mark.parametrize('stop, data', CASES)
+def test_same_as_reference(stop, data, stream_type):
+    assert parse(DelimitedField(stop), data, stream_type) == \
+        parse(ReferenceDelimitedField(stop), data, stream_type)
+
+
+@pytest.mark.parametrize('stream_type', [io.BytesIO, buffered])
+def test_missing_delimiter(stream_type):
+    for field in (DelimitedField(b'\x01\x02'),
+                  ReferenceDelimitedField(b'\x01\x02')):
+        with pytest.raises(StreamError):
+            field.parse_stream(stream_type(b'abc\x01'))
+
+
+@pytest.mark.parametrize('stream_type', [io.BytesIO, buffered])
+def test_stream_left_on_delimiter(stream_type):
+    stop = b'\x13\xf7\x2b\xc8'
+    stream = stream_type(b'header' + stop + b'data')
+
+    assert DelimitedField(stop).parse_stream(stream) == b'header'
+    assert stream.tell() == 6
+    assert stream.read(len(stop)) == stop
+
+
+@pytest.mark.parametrize('shift', range(-4, 2))
+def test_chunk_boundary(shift):
+    # the delimiter starts before the end of the first chunk and ends in the
+    # next one.
+    stop = b'\x13\xf7\x2b\xc8'
+    data = bytes(CHUNK_SIZE + shift) + stop + b'remains'
+
+    assert parse(DelimitedField(stop), data, buffered) == \
+        parse(ReferenceDelimitedField(stop), data, buffered) == \
+        (bytes(CHUNK_SIZE + shift), CHUNK_SIZE + shift)
+
+
+def test_in_struct():
+    stop = b'\xaa\xbb'
+    struct = Struct('value' / DelimitedField(stop), 'remains' / GreedyBytes)
+
+    assert struct.parse(b'abc\xaa\xbbdef') == dict(value=b'abc',
+                                                  remains=b'\xaa\xbbdef')
+
+
+def test_random_inputs():
+    rng = random.Random(0)
+    for _ in range(500):
+        # a small alphabet makes partial and overlapping matches frequent
+        stop = bytes(rng.choice(b'ab') for _ in range(rng.randrange(1, 4)))
+        data = bytes(rng.choice(b'abc') for _ in range(rng.randrange(12)))
+        for stream_type in (io.BytesIO, buffered):
+            assert parse(DelimitedField(stop), data, stream_type) == \
+                parse(ReferenceDelimitedField(stop), data, stream_type)
@@ -0,0 +1,42 @@
+"""Tests of the disk image indexes."""
+import pytest
+
+from bits.index import check_index, load_index, save_index
+
+PATTERNS = [b'\x13\xf7\x2b\xc8', b'\x47\x44']
+HITS = [(10, PATTERNS[0]), (20, PATTERNS[1])]
+
+
+@pytest.fixture
+def index(tmp_path):
+    img_fp = tmp_path / 'image.bin'
+    img_fp.write_bytes(bytes(4096))
+    save_index(tmp_path / 'image.idx', img_fp, PATTERNS, HITS)
+    return img_fp, tmp_path / 'image.idx'
+
+
+def test_load(index):
+    img_fp, index_fp = index
+    check_index(index_fp, img_fp, PATTERNS)
+    assert load_index(index_fp, img_fp, PATTERNS[:1]) == HITS[:1]
+
+
+def test_modified_image(index):
+    img_fp, index_fp = index
+    img_fp.write_bytes(bytes(8192))
+    with pytest.raises(ValueError):
+        check_index(index_fp, img_fp, PATTERNS)
+
+
+def test_missing_patterns(index):
+    img_fp, index_fp = index
+    with pytest.raises(ValueError):
+        check_index(index_fp, img_fp, PATTERNS + [b'\xaa\xbb'])
+
+
+@pytest.mark.parametrize('content', [b'{', b'[]', b'{"version": 1}'])
+def test_invalid(index, content):
+    img_fp, index_fp = index
+    index_fp.write_bytes(content)
+    with pytest.raises(ValueError):
+        check_index(index_fp, img_fp, PATTERNS)
@@ -0,0 +1,28 @@
+"""Tests of the processing metrics."""
+import threading
+
+from bits import metrics
+
+
+def test_threads():
+    metrics.enable()
+    metrics.METRICS.reset()
+
+    def update():
+        for _ in range(10000):
+            metrics.count('test.count')
+            with metrics.timer('test'):
+                pass
+
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    try:
+        assert metrics.report()['counters'] == {'test.count': 80000}
+        assert set(metrics.report()['timers']) == {'test'}
+    finally:
+        metrics.enable(False)
+        metrics.METRICS.reset()
@@ -0,0 +1,235 @@
+"""Tests of the NTFS volumes, on small synthetic volumes."""
+import struct
+
+import pytest
+
+from bits.ntfs import NtfsVolume, data_runs, find_volumes, ntfs_queues
+
+CLUSTER = 4096
+RECORD = 1024
+RECORDS = 64
+CLUSTERS = 512
+MFT_RUNS = [(4, 8), (100, 8)]       # a fragmented MFT of RECORDS records
+
+
+def attr_resident(attr_type, content):
+    length = (24 + len(content) + 7) & ~7
+    attr = bytearray(length)
+    struct.pack_into('<IIBBHHHIH', attr, 0, attr_type, length, 0, 0, 24, 0,
+                     0, len(content), 24)
+    attr[24:24 + len(content)] = content
+    return bytes(attr)
+
+
+def encode_runs(runs):
+    rv = bytearray()
+    previous = 0
+    for lcn, length in runs:
+        length = length.to_bytes(8, 'little').rstrip(b'\x00')
+        if lcn is None:     # sparse run
+            rv += bytes([len(length)]) + length
+            continue
+        size = 1
+        while not -(1 << (8 * size - 1)) <= lcn - previous < \
+                1 << (8 * size - 1):
+            size += 1
+        delta = (lcn - previous).to_bytes(size, 'little', signed=True)
+        rv += bytes([size << 4 | len(length)]) + length + delta
+        previous = lcn
+    return bytes(rv + b'\x00')
+
+
+def attr_non_resident(attr_type, runs, size):
+    encoded = encode_runs(runs)
+    length = (64 + len(encoded) + 7) & ~7
+    clusters = sum(length for _, length in runs)
+    attr = bytearray(length)
+    struct.pack_into('<IIBBHHH', attr, 0, attr_type, length, 1, 0, 64, 0, 0)
+    struct.pack_into('<QQHH4xQQQ', attr, 16, 0, clusters - 1, 64, 0,
+                     clusters * CLUSTER, size, size)
+    attr[64:64 + len(encoded)] = encoded
+    return bytes(attr)
+
+
+def file_name(parent, name, namespace=1):
+    return attr_resident(0x30, struct.pack('<Q', parent | 1 << 48) +
+                         bytes(0x38) + bytes([len(name), namespace]) +
+                         name.encode('utf-16-le'))
+
+
+def record(*attrs, flags=1):
+    rv = bytearray(RECORD)
+    body = b''.join(attrs) + b'\xff\xff\xff\xff' + bytes(4)
+    struct.pack_into('<4sHHQHHHHIIQ', rv, 0, b'FILE', 48, RECORD // 512 + 1,
+                     0, 1, 1, 56, flags, 56 + len(body), RECORD, 0)
+    rv[56:56 + len(body)] = body
+
+    # update sequence: the last bytes of each sector are saved in the array
+    rv[48:50] = b'\x07\x00'
+    for i in range(1, RECORD // 512 + 1):
+        end = i * 512
+        rv[48 + 2 * i:50 + 2 * i] = rv[end - 2:end]
+        rv[end - 2:end] = b'\x07\x00'
+    return bytes(rv)
+
+
+def content(name, size):
+    return (name.encode() * size)[:size]
+
+
+def build_volume():
+    """Return a volume and the queues expected from its MFT."""
+    data = bytearray(CLUSTERS * CLUSTER)
+    free = [200]
+
+    def allocate(value, fragments=1):
+        clusters = -(-len(value) // CLUSTER)
+        per_fragment = -(-clusters // fragments)
+        runs = []
+        for first in range(0, clusters, per_fragment):
+            length = min(per_fragment, clusters - first)
+            lcn = free[0]
+            free[0] += length + 3
+            chunk = value[first * CLUSTER:(first + length) * CLUSTER]
+            data[lcn * CLUSTER:lcn * CLUSTER + len(chunk)] = chunk
+            runs.append((lcn, length))
+        return runs
+
+    qmgr0 = content('qmgr0', 3 * CLUSTER + 100)
+    qmgr1 = content('qmgr1', 200)
+    qmgr2 = content('qmgr2', CLUSTER + 10)
+    qmgr3 = content('qmgr3', 300)
+    temp = content('temp', 5000)
+
+    records = {
+        0: record(file_name(5, '$MFT'),
+                  attr_non_resident(0x80, MFT_RUNS, RECORDS * RECORD)),
+        5: record(file_name(5, '.'), flags=3),
+        40: record(file_name(5, 'ProgramData'), flags=3),
+        41: record(file_name(40, 'Microsoft'), flags=3),
+        42: record(file_name(41, 'Network'), flags=3),
+        43: record(file_name(42, 'Downloader'), flags=3),
+        50: record(file_name(5, 'Temp'), flags=3),
+        # a live queue, fragmented, with a DOS name first
+        44: record(file_name(43, 'QMGR0~1.DAT', 2), file_name(43, 'qmgr0.dat'),
+                   attr_non_resident(0x80, allocate(qmgr0, 3), len(qmgr0))),
+        # a live queue with a resident content
+        45: record(file_name(43, 'qmgr1.dat'), attr_resident(0x80, qmgr1)),
+        # a deleted queue
+        46: record(file_name(43, 'QMGR2.DAT'),
+                   attr_non_resident(0x80, allocate(qmgr2), len(qmgr2)),
+                   flags=0),
+        # a name crossing the end of the first sector of the record
+        47: record(attr_resident(0x10, bytes(336)), file_name(43, 'qmgr3.dat'),
+                   attr_resident(0x80, qmgr3)),
+        48: record(file_name(43, 'qmgr.log'), attr_resident(0x80, b'log')),
+        # a queue out of the Downloader directory
+        49: record(file_name(50, 'qmgr0.dat'),
+                   attr_non_resident(0x80, allocate(temp), len(temp))),
+    }
+
+    # a torn record: its second sector was not written
+    torn = bytearray(record(file_name(43, 'qmgr9.dat'),
+                            attr_resident(0x80, b'torn')))
+    torn[RECORD - 2:RECORD] = b'\x09\x09'
+    records[51] = bytes(torn)
+
+    for number in range(RECORDS):
+        offset = number * RECORD
+        for lcn, length in MFT_RUNS:
+            if offset < length * CLUSTER:
+                position = lcn * CLUSTER + offset
+                data[position:position + RECORD] = records.get(number,
+                                                              bytes(RECORD))
+                break
+            offset -= length * CLUSTER
+
+    boot = bytearray(512)
+    struct.pack_into('<3s8sHB', boot, 0, b'\xebR\x90', b'NTFS    ', 512,
+                     CLUSTER // 512)
+    struct.pack_into('<QQb', boot, 0x30, MFT_RUNS[0][0], 2, -10)
+    boot[510:512] = b'\x55\xaa'
+    data[:512] = boot
+
+    prefix = '\\ProgramData\\Microsoft\\Network\\Downloader\\'
+    return bytes(data), {
+        prefix + 'qmgr0.dat': qmgr0,
+        prefix + 'qmgr1.dat': qmgr1,
+        prefix + 'QMGR2.DAT': qmgr2,
+        prefix + 'qmgr3.dat': qmgr3,
+    }
+
+
+def mbr_disk(data, lba=2048):
+    mbr = bytearray(512)
+    struct.pack_into('<B3xII', mbr, 446 + 4, 7, lba, len(data) // 512)
+    mbr[510:512] = b'\x55\xaa'
+    return bytes(mbr) + bytes(lba * 512 - 512) + data
+
+
+def gpt_disk(data, lba=2048):
+    mbr = bytearray(512)
+    struct.pack_into('<B3xII', mbr, 446 + 4, 0xee, 1, 0xffffffff)
+    mbr[510:512] = b'\x55\xaa'
+    header = bytearray(512)
+    header[:8] = b'EFI PART'
+    struct.pack_into('<QII', header, 72, 2, 128, 128)
+    entries = bytearray(128 * 128)
+    entries[:16] = bytes.fromhex('a2a0d0ebe5b9334487c068b6b72699c7')
+    entries[16:32] = b'\x11' * 16
+    struct.pack_into('<QQ', entries, 32, lba, lba + len(data) // 512)
+    disk = bytes(mbr + header + entries)
+    return disk + bytes(lba * 512 - len(disk)) + data
+
+
+@pytest.mark.parametrize('runs', [
+    [(4, 8)],
+    [(4, 8), (100, 8), (20, 1)],        # negative offset
+    [(0x12345, 0x100), (None, 3), (0x10, 2)],
+])
+def test_data_runs(runs):
+    assert list(data_runs(encode_runs(runs))) == runs
+
+
+def test_queues(tmp_path):
+    data, queues = build_volume()
+    img_fp = tmp_path / 'volume.bin'
+    img_fp.write_bytes(data)
+
+    assert dict(ntfs_queues(img_fp)) == queues
+
+
+@pytest.mark.parametrize('disk', [mbr_disk, gpt_disk])
+def test_partitioned_disk(tmp_path, disk):
+    data, queues = build_volume()
+    img_fp = tmp_path / 'disk.bin'
+    img_fp.write_bytes(disk(data))
+
+    with img_fp.open('rb') as f:
+        assert list(find_volumes(f)) == [2048 * 512]
+    assert dict(ntfs_queues(img_fp)) == {
+        '%d:%s' % (2048 * 512, path): value for path, value in queues.items()}
+
+
+def test_records(tmp_path):
+    data, _ = build_volume()
+    img_fp = tmp_path / 'volume.bin'
+    img_fp.write_bytes(data)
+
+    with img_fp.open('rb') as f:
+        volume = NtfsVolume(f)
+        assert volume.record(44).in_use
+        assert volume.record(44).name == 'qmgr0.dat'
+        assert not volume.record(46).in_use
+        assert volume.record(51) is None           # torn
+
+        # without the parent filter, the queue of \Temp is found
+        found = {'\\'.join(path): record.number
+                 for path, record in volume.find('qmgr*.dat')}
+        assert found == {
+            'ProgramData\\Microsoft\\Network\\Downloader\\qmgr0.dat': 44,
+            'ProgramData\\Microsoft\\Network\\Downloader\\qmgr1.dat': 45,
+            'ProgramData\\Microsoft\\Network\\Downloader\\QMGR2.DAT': 46,
+            'ProgramData\\Microsoft\\Network\\Downloader\\qmgr3.dat': 47,
+            'Temp\\qmgr0.dat': 49,
+        }
@@ -0,0 +1,63 @@
+"""Tests of the pipeline stages."""
+import threading
+import time
+
+import pytest
+
+from bits.pipeline import prefetch
+
+
+def test_items():
+    assert list(prefetch(range(100), maxsize=4)) == list(range(100))
+
+
+def test_failure():
+    def items():
+        yield 1
+        raise ValueError('stage failure')
+
+    stage = prefetch(items())
+    assert next(stage) == 1
+    with pytest.raises(ValueError):
+        next(stage)
+
+
+def test_close_slow_producer():
+    # the consumer does not wait for the next item of a slow producer
+    released = threading.Event()
+
+    def items():
+        try:
+            yield 1
+            time.sleep(1)
+            yield 2
+        finally:
+            released.set()
+
+    stage = prefetch(items())
+    assert next(stage) == 1
+
+    start = time.perf_counter()
+    stage.close()
+    assert time.perf_counter() - start < 0.5
+
+    # the producer stops in the background, once its item is available
+    assert released.wait(5)
+
+
+def test_close_blocked_producer():
+    # a producer blocked on the full queue is stopped and released
+    released = threading.Event()
+
+    def items():
+        try:
+            yield from range(100)
+        finally:
+            released.set()
+
+    stage = prefetch(items(), maxsize=2)
+    assert next(stage) == 0
+    time.sleep(0.1)     # the queue is full
+
+    stage.close()
+    assert released.is_set()
@@ -0,0 +1,44 @@
+"""Tests of the disk sampler."""
+import io
+import random
+
+import pytest
+
+from bits.sampler import sample_disk, sample_stream
+
+PATTERNS = [b'\x13\xf7\x2b\xc8', b'\x47\x44\x46']
+
+
+def image(seed, size=1 << 20, count=40):
+    rng = random.Random(seed)
+    data = bytearray(size)
+    for _ in range(count):
+        pattern = rng.choice(PATTERNS)
+        offset = rng.randrange(size - len(pattern))
+        data[offset:offset + len(pattern)] = pattern
+    return bytes(data)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('seed', range(4))
+def test_progressive(tmp_path, seed, workers):
+    img_fp = tmp_path / 'image.bin'
+    img_fp.write_bytes(image(seed))
+
+    samples = list(sample_disk(img_fp, PATTERNS, radiance=4, block_size=16,
+                               workers=workers, offsets=True))
+    assert list(sample_disk(img_fp, PATTERNS, radiance=4, block_size=16,
+                            workers=workers, offsets=True,
+                            progressive=True)) == samples
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_stream(tmp_path, seed):
+    data = image(seed)
+    img_fp = tmp_path / 'image.bin'
+    img_fp.write_bytes(data)
+
+    assert list(sample_stream(io.BytesIO(data), PATTERNS, radiance=4,
+                              block_size=16, offsets=True)) == \
+        list(sample_disk(img_fp, PATTERNS, radiance=4, block_size=16,
+                         offsets=True))
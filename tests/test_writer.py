@@ -0,0 +1,46 @@
+"""Tests of the writers."""
+import json
+import sqlite3
+
+from bits.const import SIZE_UNKNOWN
+from bits.records import Job
+from bits.writer import write_jsonl, write_sqlite
+
+
+def unknown_sizes_job():
+    return Job.from_mapping({
+        'job_id': 'a9f2bb80-3b1b-4c39-8d1b-b2e9f67b2c10',
+        'name': 'update',
+        'file_count': 2,
+        'files': [
+            {'dest_fn': 'C:\\update.exe', 'download_size': SIZE_UNKNOWN,
+             'transfer_size': SIZE_UNKNOWN},
+            {'dest_fn': 'C:\\update.dat', 'download_size': 2 ** 63,
+             'transfer_size': 12},
+        ],
+    })
+
+
+def test_sqlite_unknown_sizes(tmp_path):
+    fp = tmp_path / 'jobs.db'
+    write_sqlite(fp, [unknown_sizes_job(), unknown_sizes_job()])
+
+    db = sqlite3.connect(str(fp))
+    try:
+        assert db.execute('SELECT job, download_size, transfer_size '
+                          'FROM files ORDER BY id').fetchall() == [
+            (1, None, None), (1, str(2 ** 63), 12),
+            (2, None, None), (2, str(2 ** 63), 12),
+        ]
+    finally:
+        db.close()
+
+
+def test_jsonl_unknown_sizes(tmp_path):
+    fp = tmp_path / 'jobs.jsonl'
+    write_jsonl(fp, [unknown_sizes_job()])
+
+    job, = [json.loads(line) for line in fp.read_text().splitlines()]
+    assert [(f['download_size'], f['transfer_size'])
+            for f in job['files']] == [(SIZE_UNKNOWN, SIZE_UNKNOWN),
+                                       (2 ** 63, 12)]